@@ -0,0 +1,224 @@
+"""Simulated fleet of IOS devices for the pipeline benchmark.
+
+Two flavours share the same behaviour (canned outputs, per-command latency,
+failure rate):
+
+- FakeConnection stands in for a netmiko connection inside the benchmark
+  process, so the run measures the pipeline rather than SSH.
+- FakeFleet serves each device over real SSH (paramiko) on its own loopback
+  address, so netmiko and the session pool are exercised end to end. Run it
+  standalone with "python fake_ios.py --devices 50 --port 2222".
+"""
+
+import argparse
+import random
+import selectors
+import socket
+import threading
+import time
+
+import paramiko
+
+from fixtures import device_outputs
+
+INVALID_INPUT = "% Invalid input detected at '^' marker."
+
+
+def device_address(index):
+    """Loopback address of the index-th device (all of 127/8 is local)."""
+    return f"127.10.{index // 250}.{index % 250 + 1}"
+
+
+class DeviceProfile:
+    """What a simulated device answers and how slow and unreliable it is."""
+
+    def __init__(
+        self,
+        index,
+        latency=0.05,
+        jitter=0.5,
+        failure_rate=0.0,
+        interfaces=8,
+        config_lines=300,
+        seed=None,
+    ):
+        self.index = index
+        self.hostname = f"R{index}"
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.outputs = device_outputs(index, interfaces, config_lines)
+        self._random = random.Random(index if seed is None else f"{seed}-{index}")
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """Seconds one command takes, latency +/- jitter (as a fraction)."""
+        with self._lock:
+            spread = self._random.uniform(-self.jitter, self.jitter)
+        return max(0.0, self.latency * (1 + spread))
+
+    def fails(self):
+        with self._lock:
+            return self._random.random() < self.failure_rate
+
+    def answer(self, command):
+        command = " ".join(command.split())
+        if command in self.outputs:
+            return self.outputs[command]
+        if command.startswith("terminal "):
+            return ""
+        return INVALID_INPUT
+
+
+class FakeConnection:
+    """In-process stand-in for a netmiko connection to a DeviceProfile."""
+
+    def __init__(self, profile):
+        if profile.fails():
+            raise ConnectionError(f"{profile.hostname}: connection timed out")
+        self.profile = profile
+        self.alive = True
+
+    def send_command(self, command, **kwargs):
+        time.sleep(self.profile.delay())
+        return self.profile.answer(command)
+
+    def is_alive(self):
+        return self.alive
+
+    def disconnect(self):
+        self.alive = False
+
+
+class _SSHServer(paramiko.ServerInterface):
+    def __init__(self, profile):
+        self.profile = profile
+        self.shell = threading.Event()
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if self.profile.fails():
+            return paramiko.AUTH_FAILED
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, *args):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        self.shell.set()
+        return True
+
+
+class FakeFleet:
+    """Serve DeviceProfiles over SSH, one loopback address per device."""
+
+    def __init__(self, profiles, port=2222):
+        self.profiles = profiles
+        self.port = port
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self._selector = selectors.DefaultSelector()
+        self._stopped = threading.Event()
+
+    def start(self):
+        for profile in self.profiles:
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind((device_address(profile.index), self.port))
+            listener.listen(16)
+            listener.setblocking(False)
+            self._selector.register(listener, selectors.EVENT_READ, profile)
+        threading.Thread(target=self._accept, name="fleet", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def _accept(self):
+        while not self._stopped.is_set():
+            for key, _ in self._selector.select(timeout=0.5):
+                sock, _ = key.fileobj.accept()
+                sock.setblocking(True)
+                threading.Thread(
+                    target=self._serve, args=(sock, key.data), daemon=True
+                ).start()
+
+    def _serve(self, sock, profile):
+        transport = paramiko.Transport(sock)
+        transport.add_server_key(self.host_key)
+        server = _SSHServer(profile)
+        try:
+            transport.start_server(server=server)
+            channel = transport.accept(20)
+            if channel is None or not server.shell.wait(10):
+                return
+            self._shell(channel, profile)
+        except (EOFError, OSError, paramiko.SSHException):
+            pass
+        finally:
+            transport.close()
+
+    def _shell(self, channel, profile):
+        prompt = f"{profile.hostname}#"
+        channel.sendall(f"\r\n{prompt}".encode())
+        buffer = ""
+        while True:
+            data = channel.recv(4096)
+            if not data:
+                return
+            buffer += data.decode(errors="replace")
+            # netmiko ends commands with "\n"; a "\r" before it is dropped
+            while "\n" in buffer:
+                line, buffer = buffer.split("\n", 1)
+                command = line.strip()
+                if not command:
+                    channel.sendall(f"\r\n{prompt}".encode())
+                    continue
+                time.sleep(profile.delay())
+                output = profile.answer(command)
+                reply = command + "\r\n"
+                if output:
+                    reply += output.replace("\n", "\r\n") + "\r\n"
+                channel.sendall((reply + prompt).encode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--port", type=int, default=2222)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--interfaces", type=int, default=8)
+    parser.add_argument("--config-lines", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    profiles = [
+        DeviceProfile(
+            i,
+            latency=args.latency,
+            jitter=args.jitter,
+            failure_rate=args.failure_rate,
+            interfaces=args.interfaces,
+            config_lines=args.config_lines,
+            seed=args.seed,
+        )
+        for i in range(args.devices)
+    ]
+    FakeFleet(profiles, port=args.port).start()
+    print(
+        f"ready: {args.devices} devices on "
+        f"{device_address(0)}..{device_address(args.devices - 1)}:{args.port}",
+        flush=True,
+    )
+    threading.Event().wait()
+
+
+if __name__ == "__main__":
+    main()
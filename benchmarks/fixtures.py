@@ -0,0 +1,85 @@
+"""Canned IOS command outputs served by the fake devices."""
+
+SHOW_VERSION = """\
+Cisco IOS XE Software, Version 17.03.04a
+Cisco IOS Software [Amsterdam], Virtual XE Software \
+(X86_64_LINUX_IOSD-UNIVERSALK9-M), Version 17.3.4a, RELEASE SOFTWARE (fc3)
+Technical Support: http://www.cisco.com/techsupport
+Copyright (c) 1986-2021 by Cisco Systems, Inc.
+Compiled Tue 20-Jul-21 04:59 by mcpre
+
+ROM: IOS-XE ROMMON
+
+{hostname} uptime is 1 year, 2 weeks, 3 days, 4 hours, 5 minutes
+Uptime for this control processor is 1 year, 2 weeks, 3 days, 4 hours, 7 minutes
+System returned to ROM by reload
+System image file is "bootflash:packages.conf"
+Last reload reason: reload
+
+cisco CSR1000V (VXE) processor (revision VXE) with 2072007K/3075K bytes of memory.
+Processor board ID 9{serial}
+Router operating mode: Autonomous
+{interfaces} Gigabit Ethernet interfaces
+32768K bytes of non-volatile configuration memory.
+3978464K bytes of physical memory.
+6188032K bytes of virtual hard disk at bootflash:.
+
+Configuration register is 0x2102
+"""
+
+INTERFACE_HEADER = (
+    "Interface              IP-Address      OK? Method Status"
+    "                Protocol"
+)
+
+
+def show_ip_interface_brief(interfaces, index):
+    rows = [INTERFACE_HEADER]
+    for n in range(1, interfaces + 1):
+        if n % 4 == 0:
+            address, status, proto = "unassigned", "administratively down", "down"
+        else:
+            address = f"10.{index // 250 % 250}.{index % 250}.{n}"
+            status, proto = "up", "up"
+        rows.append(
+            f"GigabitEthernet{n:<8} {address:<15} YES NVRAM  {status:<21} {proto}"
+        )
+    return "\n".join(rows)
+
+
+def show_running_config(hostname, interfaces, config_lines):
+    lines = [
+        "Building configuration...",
+        "",
+        f"Current configuration : {config_lines * 30} bytes",
+        "!",
+        "version 17.3",
+        f"hostname {hostname}",
+        "!",
+    ]
+    for n in range(1, interfaces + 1):
+        lines += [
+            f"interface GigabitEthernet{n}",
+            f" description uplink {n}",
+            " ip address dhcp",
+            " negotiation auto",
+            "!",
+        ]
+    n = 0
+    while len(lines) < config_lines - 1:
+        n += 1
+        lines += [f"ip route 192.168.{n % 250}.0 255.255.255.0 10.0.0.{n % 250 + 1}"]
+    lines.append("end")
+    return "\n".join(lines)
+
+
+def device_outputs(index, interfaces=8, config_lines=300):
+    """Command -> output for the index-th simulated device."""
+    hostname = f"R{index}"
+    return {
+        "show version": SHOW_VERSION.format(
+            hostname=hostname, serial=f"{index:010d}", interfaces=interfaces
+        ),
+        "show ip interface brief": show_ip_interface_brief(interfaces, index),
+        "show running-config": show_running_config(hostname, interfaces, config_lines),
+    }
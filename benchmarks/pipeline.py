@@ -0,0 +1,488 @@
+"""End-to-end polling pipeline benchmark against a simulated device fleet.
+
+Drives the real code path scheduler (PollSchedule + job bodies) -> broker ->
+worker JobConsumer.callback -> netmiko collection -> parsing -> MongoDB
+persistence for N simulated devices, and reports devices/minute, job latency
+percentiles (publish to ack) and the CPU spent in each stage.
+
+The broker is an in-process stand-in honouring the worker's prefetch, since
+the broker hop is not what limits a worker. Devices are in-process fakes by
+default, or real SSH endpoints with --ssh (served by fake_ios.py in a
+separate process, so its CPU is not counted). Results go to MongoDB at
+--mongo-uri (a throwaway database, dropped afterwards) or, without one, to
+an in-memory mongomock, in which case persist timings are not meaningful.
+
+Needs the worker and scheduler requirements plus benchmarks/requirements.txt.
+
+Each run is written as JSON under benchmarks/results/ so runs can be
+compared across commits:
+
+    python benchmarks/pipeline.py --devices 200 --interval 10 --duration 60
+    python benchmarks/pipeline.py --compare benchmarks/results/<old>.json
+"""
+
+import argparse
+import contextlib
+import datetime
+import functools
+import json
+import math
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+import types
+from collections import defaultdict
+
+from fake_ios import DeviceProfile, FakeConnection, device_address
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def import_service(name, modules):
+    """Import a service's modules from its directory under their own names.
+
+    The scheduler and the worker both have a top-level 'database' module, so
+    each service's modules are taken back out of sys.modules once loaded.
+    """
+    path = os.path.join(ROOT, name)
+    sys.path.insert(0, path)
+    try:
+        loaded = {module: __import__(module) for module in modules}
+    finally:
+        sys.path.remove(path)
+        for module in ("database", "polling", "producer", "retention", *modules):
+            sys.modules.pop(module, None)
+    return types.SimpleNamespace(**loaded)
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return round(values[rank - 1], 4)
+
+
+class StageProfiler:
+    """Per-stage call counts, thread CPU and wall time.
+
+    Time spent in a nested profiled stage (e.g. parsing inside collection) is
+    only counted for the inner stage.
+    """
+
+    def __init__(self):
+        self.stats = defaultdict(lambda: [0, 0.0, 0.0])
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def wrap(self, stage, fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            stack = self._local.__dict__.setdefault("stack", [])
+            stack.append([0.0, 0.0])
+            cpu, wall = time.thread_time(), time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                cpu = time.thread_time() - cpu
+                wall = time.perf_counter() - wall
+                child_cpu, child_wall = stack.pop()
+                if stack:
+                    stack[-1][0] += cpu
+                    stack[-1][1] += wall
+                with self._lock:
+                    entry = self.stats[stage]
+                    entry[0] += 1
+                    entry[1] += cpu - child_cpu
+                    entry[2] += wall - child_wall
+
+        return timed
+
+    def report(self, jobs):
+        return {
+            stage: {
+                "calls": calls,
+                "cpu_s": round(cpu, 4),
+                "wall_s": round(wall, 4),
+                "cpu_ms_per_job": round(cpu * 1000 / jobs, 3) if jobs else None,
+            }
+            for stage, (calls, cpu, wall) in sorted(self.stats.items())
+        }
+
+
+class InProcessBroker:
+    """Just enough of a pika connection and channel for JobConsumer.
+
+    Messages are delivered while fewer than 'prefetch' are unacked, like
+    basic_qos. Acks and timers run on the thread calling run_pending(), as
+    they would on the pika connection thread.
+    """
+
+    def __init__(self, prefetch):
+        self.prefetch = prefetch
+        self.ready = []
+        self.unacked = {}
+        self.published = {}
+        self.latencies = []
+        self.nacked = 0
+        self._tags = 0
+        self._callbacks = queue.Queue()
+        self._timers = {}
+
+    def publish(self, body):
+        self._tags += 1
+        self.published[self._tags] = time.monotonic()
+        self.ready.append((self._tags, body, False))
+
+    def deliver(self, callback):
+        while self.ready and len(self.unacked) < self.prefetch:
+            tag, body, redelivered = self.ready.pop(0)
+            self.unacked[tag] = body
+            method = types.SimpleNamespace(delivery_tag=tag, redelivered=redelivered)
+            callback(self, method, None, body)
+
+    def idle(self):
+        return not self.ready and not self.unacked
+
+    def run_pending(self, timeout):
+        """Run queued callbacks and due timers, waiting up to 'timeout'."""
+        now = time.monotonic()
+        for handle, (due, callback) in list(self._timers.items()):
+            if due <= now:
+                del self._timers[handle]
+                callback()
+        try:
+            callback = self._callbacks.get(timeout=max(0.0, timeout))
+        except queue.Empty:
+            return
+        callback()
+        while True:
+            try:
+                self._callbacks.get_nowait()()
+            except queue.Empty:
+                return
+
+    # pika connection API used by JobConsumer
+    def add_callback_threadsafe(self, callback):
+        self._callbacks.put(callback)
+
+    def call_later(self, delay, callback):
+        handle = object()
+        self._timers[handle] = (time.monotonic() + delay, callback)
+        return handle
+
+    def remove_timeout(self, handle):
+        self._timers.pop(handle, None)
+
+    def process_data_events(self, time_limit=0):
+        self.run_pending(time_limit)
+
+    # pika channel API used by JobConsumer
+    def basic_ack(self, delivery_tag):
+        self.unacked.pop(delivery_tag)
+        self.latencies.append(time.monotonic() - self.published.pop(delivery_tag))
+
+    def basic_nack(self, delivery_tag, requeue=True):
+        body = self.unacked.pop(delivery_tag)
+        self.nacked += 1
+        if requeue:
+            self.ready.append((delivery_tag, body, True))
+        else:
+            self.published.pop(delivery_tag)
+
+    def basic_reject(self, delivery_tag, requeue=True):
+        self.basic_nack(delivery_tag, requeue)
+
+
+def start_ssh_fleet(args):
+    fleet = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_ios.py"),
+            f"--devices={args.devices}",
+            f"--port={args.ssh_port}",
+            f"--latency={args.latency}",
+            f"--jitter={args.jitter}",
+            f"--failure-rate={args.failure_rate}",
+            f"--interfaces={args.interfaces}",
+            f"--config-lines={args.config_lines}",
+            *([f"--seed={args.seed}"] if args.seed is not None else []),
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    line = fleet.stdout.readline()
+    if not line.startswith("ready"):
+        fleet.kill()
+        raise SystemExit(f"fake fleet did not start: {line!r}")
+    return fleet
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def configure_worker_env(args):
+    """Environment the worker reads at import time."""
+    os.environ["COLLECTOR_ENGINE"] = "netmiko"
+    os.environ["WORKER_BATCH_SIZE"] = "1"
+    os.environ["WORKER_CONCURRENCY"] = str(args.concurrency)
+    os.environ["SESSION_POOL_SIZE"] = str(args.devices)
+    os.environ["DB_NAME"] = args.db
+    if args.prefetch:
+        os.environ["WORKER_PREFETCH"] = str(args.prefetch)
+    if args.mongo_uri:
+        os.environ["MONGODB_URI"] = args.mongo_uri
+
+
+def use_mongomock(database):
+    import mongomock
+    from mongomock.collection import BulkOperationBuilder
+
+    # mongomock predates the 'sort' option pymongo 4.11+ passes for UpdateOne
+    add_update = BulkOperationBuilder.add_update
+    BulkOperationBuilder.add_update = lambda self, *a, sort=None, **kw: add_update(
+        self, *a, **kw
+    )
+    database._client = mongomock.MongoClient()
+
+
+def run(args):
+    configure_worker_env(args)
+    scheduler = import_service("scheduler", ["polling", "scheduler"])
+    worker = import_service("worker", ["database", "sessions", "worker"])
+
+    if args.mongo_uri:
+        worker.database.get_db().client.drop_database(args.db)
+    else:
+        use_mongomock(worker.database)
+    worker.database.ensure_indexes()
+
+    profiles = {}
+    devices = {}
+    for index in range(args.devices):
+        ip = (
+            device_address(index)
+            if args.ssh
+            else f"10.200.{index // 250}.{index % 250}"
+        )
+        profiles[ip] = DeviceProfile(
+            index,
+            latency=args.latency,
+            jitter=args.jitter,
+            failure_rate=args.failure_rate,
+            interfaces=args.interfaces,
+            config_lines=args.config_lines,
+            seed=args.seed,
+        )
+        devices[ip] = {
+            "ip": ip,
+            "username": "bench",
+            "password": "bench",
+            "device_type": "cisco_ios",
+        }
+
+    fleet = None
+    if args.ssh:
+        fleet = start_ssh_fleet(args)
+        worker.sessions.ConnectHandler = functools.partial(
+            worker.sessions.ConnectHandler, port=args.ssh_port
+        )
+    else:
+        worker.sessions.ConnectHandler = lambda host, **kwargs: FakeConnection(
+            profiles[host]
+        )
+
+    profiler = StageProfiler()
+    unreachable = []
+    record_poll_result = worker.database.record_poll_result
+
+    def record(ip, reachable):
+        if not reachable:
+            unreachable.append(ip)
+        return record_poll_result(ip, reachable)
+
+    worker.worker.process_job = profiler.wrap("job", worker.worker.process_job)
+    worker.worker.collect_netmiko = profiler.wrap(
+        "collect", worker.worker.collect_netmiko
+    )
+    worker.worker.normalize_output = profiler.wrap(
+        "parse", worker.worker.normalize_output
+    )
+    worker.database.set_device_infos = profiler.wrap(
+        "persist", worker.database.set_device_infos
+    )
+    worker.database.record_poll_result = profiler.wrap("persist", record)
+    dispatch = profiler.wrap(
+        "dispatch",
+        lambda due: [
+            broker.publish(scheduler.scheduler.build_job(device, commands))
+            for device, commands in due
+        ],
+    )
+
+    broker = InProcessBroker(prefetch=worker.worker.effective_prefetch(1))
+    consumer = worker.worker.JobConsumer(
+        broker, broker, worker.worker.CONCURRENCY, batch_size=1
+    )
+    consume = profiler.wrap("consume", consumer.callback)
+    schedule = scheduler.polling.PollSchedule(default_interval=args.interval)
+
+    output = open(os.devnull, "w") if not args.verbose else sys.stdout
+    cpu_started = time.process_time()
+    started = time.monotonic()
+    stop_scheduling = started + args.duration
+    deadline = stop_scheduling + args.drain_timeout
+    try:
+        with contextlib.redirect_stdout(output):
+            while True:
+                now = time.monotonic()
+                if now < stop_scheduling:
+                    schedule.sync(devices, now)
+                    dispatch(schedule.pop_due(devices, now))
+                elif broker.idle() or now > deadline:
+                    break
+                broker.deliver(consume)
+                wake = schedule.next_due() or now
+                broker.run_pending(min(0.05, max(0.0, wake - time.monotonic())))
+            consumer.shutdown()
+    finally:
+        wall = time.monotonic() - started
+        cpu = time.process_time() - cpu_started
+        worker.worker.get_session_pool().close_all()
+        if fleet is not None:
+            fleet.kill()
+        if args.mongo_uri and not args.keep_db:
+            worker.database.get_db().client.drop_database(args.db)
+
+    latencies = sorted(broker.latencies)
+    completed = len(latencies)
+    return {
+        "benchmark": "pipeline",
+        "started_at": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "params": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("compare", "mongo_uri", "output", "verbose")
+        },
+        "persistence": "mongodb" if args.mongo_uri else "mongomock",
+        "results": {
+            "jobs_published": broker._tags,
+            "jobs_completed": completed,
+            "jobs_unfinished": len(broker.ready) + len(broker.unacked),
+            "jobs_nacked": broker.nacked,
+            "devices_unreachable": len(unreachable),
+            "wall_s": round(wall, 3),
+            "devices_per_minute": round(completed / wall * 60, 1) if wall else None,
+            "latency_s": {
+                "p50": percentile(latencies, 50),
+                "p90": percentile(latencies, 90),
+                "p99": percentile(latencies, 99),
+                "max": percentile(latencies, 100),
+            },
+            "process_cpu_s": round(cpu, 3),
+            "stages": profiler.report(completed),
+        },
+    }
+
+
+def compare(current, baseline):
+    """Print the relative change of the headline numbers against a baseline."""
+    rows = [
+        ("devices_per_minute", lambda r: r["devices_per_minute"]),
+        ("latency p50", lambda r: r["latency_s"]["p50"]),
+        ("latency p99", lambda r: r["latency_s"]["p99"]),
+        ("process_cpu_s", lambda r: r["process_cpu_s"]),
+    ]
+    for stage in current["results"]["stages"]:
+        rows.append(
+            (
+                f"{stage} cpu_ms_per_job",
+                lambda r, s=stage: r["stages"].get(s, {}).get("cpu_ms_per_job"),
+            )
+        )
+    print(f"{'metric':<28}{'baseline':>12}{'current':>12}{'change':>10}")
+    for label, get in rows:
+        old, new = get(baseline["results"]), get(current["results"])
+        change = f"{(new - old) / old * 100:+.1f}%" if old and new is not None else ""
+        print(f"{label:<28}{old!s:>12.10}{new!s:>12.10}{change:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument(
+        "--interval", type=float, default=10, help="poll interval per device (s)"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30, help="seconds to keep scheduling"
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=60,
+        help="seconds to wait for queued jobs after scheduling stops",
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--prefetch", type=int, default=0)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="seconds per command"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.5, help="latency spread, as a fraction"
+    )
+    parser.add_argument(
+        "--failure-rate",
+        type=float,
+        default=0.0,
+        help="share of connection attempts that fail",
+    )
+    parser.add_argument("--interfaces", type=int, default=8)
+    parser.add_argument("--config-lines", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--ssh", action="store_true", help="talk to the fleet over real SSH"
+    )
+    parser.add_argument("--ssh-port", type=int, default=2222)
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCH_MONGODB_URI"))
+    parser.add_argument("--db", default="ipa_benchmark")
+    parser.add_argument("--keep-db", action="store_true")
+    parser.add_argument(
+        "--output", help="result file (default: results/<commit>-<time>.json)"
+    )
+    parser.add_argument("--compare", help="baseline result file to compare with")
+    parser.add_argument("--verbose", action="store_true", help="show worker logs")
+    args = parser.parse_args()
+
+    result = run(args)
+    path = args.output or os.path.join(
+        RESULTS_DIR,
+        f"{result['commit'] or 'nocommit'}-"
+        f"{result['started_at'].replace(':', '').replace('-', '')}.json",
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(json.dumps(result["results"], indent=2))
+    print(f"Saved {path}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,156 @@
 import os
+import threading
+import time
+import datetime
 from pymongo import MongoClient
+from pymongo.errors import OperationFailure, PyMongoError
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Only the fields a job message or the poll schedule needs; running_config,
+# interfaces etc. stay in Mongo
+DEVICE_PROJECTION = {
+    "ip": 1,
+    "username": 1,
+    "password": 1,
+    "device_type": 1,
+    "poll_interval": 1,
+    "poll_intervals": 1,
+    "consecutive_failures": 1,
+}
 
-def get_router_info():
-    mongo_uri = os.environ.get("MONGODB_URI")
-    db_name = os.environ.get("DB_NAME")
-    client = MongoClient(mongo_uri)
-    db = client[db_name]
-    routers = db["devices"]
-    print(mongo_uri)
-    print(db_name)
-    router_data = routers.find()
-    return router_data
+# Delta queries look back this much further than strictly needed, so clock
+# skew between the web app and the scheduler cannot hide an update
+CLOCK_SKEW = datetime.timedelta(seconds=5)
 
 
-if __name__ == "__main__":
-    get_router_info()
+# Change stream events are cut down to the same fields before they leave the
+# server; the updateLookup documents would otherwise carry whole devices
+CHANGE_PIPELINE = [
+    {
+        "$project": {
+            "operationType": 1,
+            "documentKey": 1,
+            **{f"fullDocument.{field}": 1 for field in DEVICE_PROJECTION},
+        }
+    }
+]
+
+
+class DeviceInventory:
+    """In-memory index of the devices collection, kept current in the background.
+
+    The inventory is loaded once with a minimal projection. Afterwards a
+    change stream applies inserts, updates and deletes as they happen. When
+    change streams are unavailable (standalone mongod) it falls back to
+    polling every 'refresh_interval' seconds: an 'updated_at' delta query
+    plus a cheap _id-only reconciliation that picks up inserts and deletes.
+    Reading the inventory never touches the database.
+    """
+
+    def __init__(self, refresh_interval=10):
+        self.refresh_interval = refresh_interval
+        self.client = MongoClient(os.environ.get("MONGODB_URI"))
+        self.collection = self.client[os.environ.get("DB_NAME")]["devices"]
+        self._devices = {}
+        self._lock = threading.Lock()
+        self._watermark = None
+        self._thread = None
+
+    def start(self):
+        self.reload()
+        self._thread = threading.Thread(
+            target=self._follow, name="device-inventory", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def devices(self):
+        """Return a snapshot list of the known devices."""
+        with self._lock:
+            return list(self._devices.values())
+
+    def reload(self):
+        """Full load of the inventory, replacing whatever is held."""
+        started = datetime.datetime.utcnow()
+        devices = {
+            doc["_id"]: doc for doc in self.collection.find({}, DEVICE_PROJECTION)
+        }
+        with self._lock:
+            self._devices = devices
+        self._watermark = started - CLOCK_SKEW
+        print(f"Loaded {len(devices)} devices into the inventory")
+
+    def _follow(self):
+        while True:
+            try:
+                self._watch()
+            except OperationFailure as e:
+                # Change streams need a replica set; poll instead
+                print(
+                    f"Change streams unavailable ({e}), polling every "
+                    f"{self.refresh_interval}s"
+                )
+                self._poll()
+            except PyMongoError as e:
+                print(f"Inventory watcher error: {e}, reloading")
+                time.sleep(self.refresh_interval)
+                try:
+                    self.reload()
+                except PyMongoError as reload_error:
+                    print(reload_error)
+
+    def _watch(self):
+        with self.collection.watch(
+            CHANGE_PIPELINE, full_document="updateLookup"
+        ) as stream:
+            # Anything changed between the initial load and opening the stream
+            self._apply_delta()
+            for change in stream:
+                if "documentKey" not in change:
+                    # drop/rename/invalidate: start over from a full load
+                    self.reload()
+                    return
+                key = change["documentKey"]["_id"]
+                document = change.get("fullDocument")
+                with self._lock:
+                    if document is None:
+                        self._devices.pop(key, None)
+                    else:
+                        self._devices[key] = {
+                            field: document[field]
+                            for field in ("_id", *DEVICE_PROJECTION)
+                            if field in document
+                        }
+
+    def _poll(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self._apply_delta()
+            except PyMongoError as e:
+                print(f"Inventory refresh failed: {e}")
+
+    def _apply_delta(self):
+        started = datetime.datetime.utcnow()
+        changed = list(
+            self.collection.find(
+                {"updated_at": {"$gt": self._watermark}}, DEVICE_PROJECTION
+            )
+        )
+        ids = {doc["_id"] for doc in self.collection.find({}, {"_id": 1})}
+        with self._lock:
+            known = set(self._devices)
+        # Devices written without an updated_at still show up as new ids
+        missing = ids - known - {doc["_id"] for doc in changed}
+        if missing:
+            changed.extend(
+                self.collection.find({"_id": {"$in": list(missing)}}, DEVICE_PROJECTION)
+            )
+        with self._lock:
+            for key in known - ids:
+                self._devices.pop(key, None)
+            for doc in changed:
+                self._devices[doc["_id"]] = doc
+        self._watermark = started - CLOCK_SKEW
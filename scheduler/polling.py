@@ -0,0 +1,104 @@
+import heapq
+import itertools
+import random
+
+# Commands the worker knows how to collect
+COMMANDS = ["show ip interface brief", "show running-config", "show version"]
+
+
+def parse_intervals(spec):
+    """Parse "show version=3600,show ip interface brief=30" into a dict."""
+    intervals = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        command, seconds = item.rsplit("=", 1)
+        intervals[command.strip()] = float(seconds)
+    return intervals
+
+
+class PollSchedule:
+    """Per-device, per-command polling schedule backed by a heap.
+
+    Every (device, command) pair has its own interval, resolved in order from
+    the device's 'poll_intervals' map, the device's 'poll_interval', the
+    global per-command intervals and finally the default interval. Each new
+    device gets a random phase so start times spread across the interval
+    instead of arriving in one burst. Devices whose last polls failed
+    ('consecutive_failures', maintained by the worker) back off exponentially
+    up to 'max_backoff' times their interval.
+    """
+
+    def __init__(
+        self,
+        default_interval=90,
+        command_intervals=None,
+        commands=COMMANDS,
+        max_backoff=16,
+        coalesce=1.0,
+    ):
+        self.default_interval = default_interval
+        self.command_intervals = command_intervals or {}
+        self.commands = list(commands)
+        self.max_backoff = max_backoff
+        # Items due within this many seconds of each other go out together,
+        # so one device's commands share a single job where possible
+        self.coalesce = coalesce
+        self._heap = []
+        self._scheduled = set()
+        self._seq = itertools.count()
+
+    def interval_for(self, device, command):
+        per_command = device.get("poll_intervals") or {}
+        interval = (
+            per_command.get(command)
+            or device.get("poll_interval")
+            or self.command_intervals.get(command)
+            or self.default_interval
+        )
+        failures = device.get("consecutive_failures") or 0
+        return float(interval) * min(2**failures, self.max_backoff)
+
+    def sync(self, devices, now):
+        """Schedule the commands of devices that are not scheduled yet.
+
+        'devices' maps device IP to its inventory document. Removed devices
+        are dropped lazily when their entries come due.
+        """
+        for ip, device in devices.items():
+            phase = None
+            for command in self.commands:
+                if (ip, command) in self._scheduled:
+                    continue
+                if phase is None:
+                    # One phase per device keeps its equal-interval commands aligned
+                    phase = random.random()
+                self._push(
+                    now + phase * self.interval_for(device, command), ip, command
+                )
+
+    def pop_due(self, devices, now):
+        """Return [(device, [commands])] for everything due, and reschedule it."""
+        due_jobs = {}
+        while self._heap and self._heap[0][0] <= now + self.coalesce:
+            due, _, ip, command = heapq.heappop(self._heap)
+            device = devices.get(ip)
+            if device is None:
+                self._scheduled.discard((ip, command))
+                continue
+            due_jobs.setdefault(ip, (device, []))[1].append(command)
+            interval = self.interval_for(device, command)
+            next_due = due + interval
+            if next_due <= now:
+                # Fell behind (e.g. the broker was down); don't burst to catch up
+                next_due = now + interval
+            heapq.heappush(self._heap, (next_due, next(self._seq), ip, command))
+        return list(due_jobs.values())
+
+    def next_due(self):
+        """Monotonic time of the earliest scheduled item, or None."""
+        return self._heap[0][0] if self._heap else None
+
+    def _push(self, due, ip, command):
+        self._scheduled.add((ip, command))
+        heapq.heappush(self._heap, (due, next(self._seq), ip, command))
@@ -1,31 +1,131 @@
 import os
+import time
 import pika
 from dotenv import load_dotenv
 
 load_dotenv()
 
+EXCHANGE = "jobs"
+QUEUE = "router_jobs"
+ROUTING_KEY = "check_interfaces"
 
-def produce(host, body):
 
-    rabbitmq_user = os.getenv("RABBITMQ_DEFAULT_USER")
-    rabbitmq_pass = os.getenv("RABBITMQ_DEFAULT_PASS")
-    print(rabbitmq_user)
-    print(rabbitmq_pass)
+class Producer:
+    """Long-lived RabbitMQ publisher reused across scheduler cycles.
+
+    The connection, channel and exchange/queue topology are set up once and
+    re-established transparently when the broker connection drops. The
+    channel is transactional: publish_batch commits up to 'chunk_size'
+    messages with a single round trip, and knows they were accepted once the
+    commit returns.
+    """
+
+    def __init__(self, host, max_retries=3, chunk_size=500):
+        self.host = host
+        self.max_retries = max_retries
+        self.chunk_size = chunk_size
+        self.connection = None
+        self.channel = None
+        # Messages of the current transaction the broker could not route
+        self.returned = 0
+
+    def connect(self):
+        rabbitmq_user = os.getenv("RABBITMQ_DEFAULT_USER")
+        rabbitmq_pass = os.getenv("RABBITMQ_DEFAULT_PASS")
+        credentials = pika.PlainCredentials(rabbitmq_user, rabbitmq_pass)
+        parameters = pika.ConnectionParameters(self.host, credentials=credentials)
+        self.connection = pika.BlockingConnection(parameters)
+        self.channel = self.connection.channel()
+
+        self.channel.exchange_declare(exchange=EXCHANGE, exchange_type="direct")
+        self.channel.queue_declare(queue=QUEUE)
+        self.channel.queue_bind(queue=QUEUE, exchange=EXCHANGE, routing_key=ROUTING_KEY)
+        self.channel.add_on_return_callback(self.on_return)
+        self.channel.tx_select()
 
-    credentials = pika.PlainCredentials(rabbitmq_user, rabbitmq_pass)
-    parameters = pika.ConnectionParameters(host, credentials=credentials)
-    connection = pika.BlockingConnection(parameters)
-    channel = connection.channel()
+    def on_return(self, channel, method, properties, body):
+        self.returned += 1
+        print(f"Message returned by broker: {method.reply_text}")
 
-    channel.exchange_declare(exchange="jobs", exchange_type="direct")
-    channel.queue_declare(queue="router_jobs")
-    channel.queue_bind(
-        queue="router_jobs", exchange="jobs", routing_key="check_interfaces"
-    )
+    def close(self):
+        if self.connection is not None and self.connection.is_open:
+            try:
+                self.connection.close()
+            except pika.exceptions.AMQPError:
+                pass
+        self.connection = None
+        self.channel = None
 
-    channel.basic_publish(exchange="jobs", routing_key="check_interfaces", body=body)
+    def _ensure_channel(self):
+        if (
+            self.connection is None
+            or self.connection.is_closed
+            or self.channel is None
+            or self.channel.is_closed
+        ):
+            self.close()
+            self.connect()
 
-    connection.close()
+    def sleep(self, seconds):
+        """Sleep while keeping the connection's heartbeats serviced."""
+        deadline = time.monotonic() + seconds
+        if self.connection is not None and self.connection.is_open:
+            try:
+                self.connection.sleep(seconds)
+                return
+            except pika.exceptions.AMQPError:
+                # Reconnected lazily on the next publish
+                self.close()
+        time.sleep(max(0.0, deadline - time.monotonic()))
+
+    def publish_batch(self, bodies):
+        """Publish a whole cycle's messages and return how many were accepted.
+
+        Messages go out in transactions of up to 'chunk_size', each committed
+        with one round trip. Messages the broker cannot route are reported
+        and not counted. When the connection is lost midway, it is re-opened
+        and publishing resumes from the first message of the uncommitted
+        transaction, up to max_retries times.
+        """
+        accepted = 0
+        retries = 0
+        index = 0
+        while index < len(bodies):
+            end = index + self.chunk_size
+            chunk = bodies[index:end]
+            try:
+                self._ensure_channel()
+                self.returned = 0
+                for body in chunk:
+                    self.channel.basic_publish(
+                        exchange=EXCHANGE,
+                        routing_key=ROUTING_KEY,
+                        body=body,
+                        mandatory=True,
+                    )
+                self.channel.tx_commit()
+                # Deliver the returns that arrived before the commit's reply
+                self.connection.process_data_events(time_limit=0)
+            except pika.exceptions.AMQPError as e:
+                retries += 1
+                if retries > self.max_retries:
+                    raise
+                print(f"RabbitMQ connection lost ({e!r}), reconnecting...")
+                self.close()
+                time.sleep(min(retries, 5))
+                continue
+            accepted += len(chunk) - self.returned
+            index += len(chunk)
+        return accepted
+
+
+def produce(host, body):
+    """Publish a single message on a short-lived connection."""
+    producer = Producer(host)
+    try:
+        producer.publish_batch([body])
+    finally:
+        producer.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,170 @@
+import datetime
+import os
+import threading
+import time
+
+from pymongo import ASCENDING, IndexModel, MongoClient, UpdateOne
+from pymongo.errors import PyMongoError
+
+# Raw samples that are summarised before the worker's TTL removes them
+ROLLUP_COMMAND = "show ip interface brief"
+HOUR = datetime.timedelta(hours=1)
+
+ROLLUP_INDEXES = [
+    IndexModel(
+        [("ip_address", ASCENDING), ("interface", ASCENDING), ("hour", ASCENDING)],
+        unique=True,
+        name="device_interface_hour",
+    ),
+    IndexModel([("expire_at", ASCENDING)], expireAfterSeconds=0, name="expire_at_ttl"),
+]
+
+
+def floor_hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def summarise_hour(samples, hour):
+    """Fold one device's samples of one hour into per-interface summaries.
+
+    'samples' are (time, [interface rows]) in time order. Every sample's
+    state is taken to hold until the next sample, or the end of the hour.
+    Returns {interface: {"samples", "intervals", "up_seconds"}}.
+    """
+    end_of_hour = hour + HOUR
+    summaries = {}
+    for index, (sampled_at, rows) in enumerate(samples):
+        until = samples[index + 1][0] if index + 1 < len(samples) else end_of_hour
+        for row in rows or []:
+            name = row.get("interface")
+            if not name:
+                continue
+            summary = summaries.setdefault(
+                name, {"samples": 0, "intervals": [], "up_seconds": 0.0}
+            )
+            summary["samples"] += 1
+            status, proto = row.get("status"), row.get("proto")
+            intervals = summary["intervals"]
+            if (
+                intervals
+                and intervals[-1]["status"] == status
+                and intervals[-1]["proto"] == proto
+                and intervals[-1]["end"] == sampled_at
+            ):
+                intervals[-1]["end"] = until
+            else:
+                intervals.append(
+                    {
+                        "status": status,
+                        "proto": proto,
+                        "start": sampled_at,
+                        "end": until,
+                    }
+                )
+            if status == "up" and proto == "up":
+                summary["up_seconds"] += (until - sampled_at).total_seconds()
+    return summaries
+
+
+class InterfaceRollup:
+    """Hourly rollup of interface status history into 'interface_rollups'.
+
+    Raw 'show ip interface brief' samples only live for their retention
+    period (RETENTION_DAYS on the worker). Each completed hour is reduced to
+    one document per device and interface holding the sample count, the
+    runs of identical status/proto and the seconds spent up/up, which is
+    kept for 'retention_days'. The last rolled-up hour is stored in
+    'retention_state', so restarts resume where they left off; re-rolling an
+    hour overwrites the same documents.
+    """
+
+    def __init__(self, interval=3600, retention_days=90):
+        self.interval = interval
+        self.retention = datetime.timedelta(days=retention_days)
+        self.client = MongoClient(os.environ.get("MONGODB_URI"))
+        self.db = self.client[os.environ.get("DB_NAME")]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="interface-rollup", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self.db["interface_rollups"].create_indexes(ROLLUP_INDEXES)
+        except PyMongoError as e:
+            print(f"Could not ensure rollup indexes: {e}")
+        while True:
+            try:
+                self.run_once(datetime.datetime.utcnow())
+            except PyMongoError as e:
+                print(f"Interface rollup failed: {e}")
+            time.sleep(self.interval)
+
+    def run_once(self, now):
+        """Roll up every completed hour since the stored watermark."""
+        current_hour = floor_hour(now)
+        hour = self._watermark()
+        if hour is None:
+            return 0
+        rolled = 0
+        while hour < current_hour:
+            self.rollup_hour(hour)
+            hour += HOUR
+            self.db["retention_state"].update_one(
+                {"_id": "interface_rollups"},
+                {"$set": {"rolled_up_to": hour}},
+                upsert=True,
+            )
+            rolled += 1
+        if rolled:
+            print(f"Rolled up {rolled} hour(s) of interface history")
+        return rolled
+
+    def rollup_hour(self, hour):
+        cursor = (
+            self.db["outputs"]
+            .find(
+                {
+                    "command": ROLLUP_COMMAND,
+                    "success": True,
+                    "created_at": {"$gte": hour, "$lt": hour + HOUR},
+                },
+                {"ip_address": 1, "created_at": 1, "output": 1},
+            )
+            .sort("created_at", ASCENDING)
+        )
+        samples = {}
+        for doc in cursor:
+            if isinstance(doc.get("output"), list):
+                samples.setdefault(doc["ip_address"], []).append(
+                    (doc["created_at"], doc["output"])
+                )
+        expire_at = hour + HOUR + self.retention
+        requests = []
+        for ip, device_samples in samples.items():
+            for name, summary in summarise_hour(device_samples, hour).items():
+                requests.append(
+                    UpdateOne(
+                        {"ip_address": ip, "interface": name, "hour": hour},
+                        {"$set": {**summary, "expire_at": expire_at}},
+                        upsert=True,
+                    )
+                )
+        if requests:
+            self.db["interface_rollups"].bulk_write(requests, ordered=False)
+
+    def _watermark(self):
+        state = self.db["retention_state"].find_one({"_id": "interface_rollups"})
+        if state and state.get("rolled_up_to"):
+            return state["rolled_up_to"]
+        # First run: start at the oldest sample still on record
+        oldest = self.db["outputs"].find_one(
+            {"command": ROLLUP_COMMAND, "created_at": {"$exists": True}},
+            {"created_at": 1},
+            sort=[("command", ASCENDING), ("created_at", ASCENDING)],
+        )
+        return floor_hour(oldest["created_at"]) if oldest else None
@@ -2,37 +2,81 @@ import time
 
 import os
 from bson import json_util
-from producer import produce
-from database import get_router_info
+from producer import Producer
+from database import DeviceInventory
+from polling import PollSchedule, parse_intervals
+from retention import InterfaceRollup
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Fields of the inventory document that only the scheduler needs
+SCHEDULING_FIELDS = ("poll_interval", "poll_intervals", "consecutive_failures")
+
+
+def build_job(device, commands):
+    """Message body asking the worker to poll 'commands' on 'device'."""
+    job = {k: v for k, v in device.items() if k not in SCHEDULING_FIELDS}
+    job["commands"] = commands
+    return json_util.dumps(job).encode("utf-8")
+
 
 def scheduler():
 
-    INTERVAL = 90
-    next_run = time.monotonic()
+    # Longest time between checks for new devices when nothing is due
+    MAX_IDLE = 1.0
     count = 0
     host = os.getenv("RABBITMQ_HOST")
+    # One connection for the lifetime of the scheduler, reused every cycle
+    producer = Producer(host)
+    # Loaded once, then kept current from Mongo in the background, so a
+    # cycle costs no database round trips
+    inventory = DeviceInventory(
+        refresh_interval=float(os.getenv("INVENTORY_REFRESH_INTERVAL", "10"))
+    ).start()
+    schedule = PollSchedule(
+        default_interval=float(os.getenv("POLL_INTERVAL", "90")),
+        command_intervals=parse_intervals(os.getenv("POLL_COMMAND_INTERVALS")),
+        max_backoff=float(os.getenv("POLL_MAX_BACKOFF", "16")),
+    )
+    # Summarises interface history hourly before raw samples expire
+    InterfaceRollup(
+        interval=float(os.getenv("ROLLUP_INTERVAL", "3600")),
+        retention_days=float(os.getenv("ROLLUP_RETENTION_DAYS", "90")),
+    ).start()
+    print(host)
 
     while True:
-        now = time.time()
-        now_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))
-        ms = int((now % 1) * 1000)
-        now_str_with_ms = f"{now_str}.{ms:03d}"
-        print(f"[{now_str_with_ms}] run #{count}")
-        print(host)
         try:
-            for data in get_router_info():
-                body_bytes = json_util.dumps(data).encode("utf-8")
-                produce(host, body_bytes)
+            devices = {
+                device["ip"]: device
+                for device in inventory.devices()
+                if device.get("ip")
+            }
+            schedule.sync(devices, time.monotonic())
+            due = schedule.pop_due(devices, time.monotonic())
+            if due:
+                bodies = [build_job(device, commands) for device, commands in due]
+                accepted = producer.publish_batch(bodies)
+
+                now = time.time()
+                now_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))
+                ms = int((now % 1) * 1000)
+                now_str_with_ms = f"{now_str}.{ms:03d}"
+                print(
+                    f"[{now_str_with_ms}] run #{count}: "
+                    f"dispatched {accepted}/{len(bodies)} jobs"
+                )
+                count += 1
         except Exception as e:
             print(e)
-            time.sleep(3)
-        count += 1
-        next_run += INTERVAL
-        time.sleep(max(0.0, next_run - time.monotonic()))
+            producer.sleep(3)
+            continue
+        next_due = schedule.next_due()
+        wake = time.monotonic() + MAX_IDLE
+        if next_due is not None:
+            wake = min(wake, next_due)
+        producer.sleep(max(0.0, wake - time.monotonic()))
 
 
 if __name__ == "__main__":
@@ -1,7 +1,25 @@
-from flask import Flask, render_template, request, redirect, flash, jsonify
-from netmiko import ConnectHandler
+from flask import (
+    Flask,
+    render_template,
+    request,
+    redirect,
+    flash,
+    jsonify,
+    url_for,
+    Response,
+    stream_with_context,
+)
+import collections
+import datetime
+import json
 import os
+import queue
+import time
+import pika
 import db
+import jobs
+import live
+import sessions
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,11 +31,35 @@ app.debug = True
 
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY")
 
+# Bulk config pushes: at most BULK_MAX_DEVICES per request; the response
+# streams results for up to BULK_STREAM_TIMEOUT seconds, checking for
+# finished devices every BULK_POLL_INTERVAL seconds
+BULK_MAX_DEVICES = int(os.getenv("BULK_MAX_DEVICES", "500"))
+BULK_STREAM_TIMEOUT = float(os.getenv("BULK_STREAM_TIMEOUT", "900"))
+BULK_POLL_INTERVAL = float(os.getenv("BULK_POLL_INTERVAL", "1"))
 
-# Teardown DB connection after website goes down
-@app.teardown_appcontext
-def shutdown_session(exception=None):
-    db.close_db()
+# Seconds between comment lines on an idle event stream, which keep proxies
+# from closing it and reveal disconnected clients
+LIVE_KEEPALIVE = float(os.getenv("LIVE_KEEPALIVE", "15"))
+
+# Make sure the indexes the queries below rely on exist
+with app.app_context():
+    try:
+        db.ensure_indexes()
+    except Exception as e:
+        print(f"Could not ensure MongoDB indexes: {e}")
+
+
+# Report how often each index is used: flask --app app index-usage
+@app.cli.command("index-usage")
+def index_usage():
+    for collection, stats in db.get_index_usage().items():
+        for stat in stats:
+            accesses = stat.get("accesses", {})
+            print(
+                f"{collection}.{stat['name']}: {accesses.get('ops', 0)} ops "
+                f"since {accesses.get('since')}"
+            )
 
 
 # Routes for web pages
@@ -48,126 +90,326 @@ def add_device_route():
     return redirect("/user_devices")
 
 
+def device_list_args():
+    """list_devices() keyword arguments from the query string."""
+    return {
+        "device_type": request.args.get("type") or None,
+        "hostname": request.args.get("q") or None,
+        "sort": request.args.get("sort", "ip"),
+        "descending": request.args.get("order") == "desc",
+        "limit": request.args.get("limit", 48),
+        "cursor": request.args.get("cursor") or None,
+    }
+
+
 @app.route("/user_devices")
 def user_devices():
-    all_devices = db.get_all_devices()
-    return render_template("user_devices.html", devices=all_devices)
+    try:
+        page = db.list_devices(**device_list_args())
+    except ValueError as e:
+        flash(str(e), "warning")
+        return redirect("/user_devices")
+    return render_template("user_devices.html", page=page, args=request.args)
+
+
+# Paginated device list: /api/devices?type=router&q=R1&sort=hostname&cursor=...
+@app.route("/api/devices")
+def api_devices():
+    try:
+        return jsonify(db.list_devices(**device_list_args()))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+
+def interface_search_args():
+    """search_interfaces() keyword arguments from the query string."""
+    return {
+        "status": request.args.get("status") or None,
+        "proto": request.args.get("proto") or None,
+        "ip_address": request.args.get("ip") or None,
+        "interface": request.args.get("interface") or None,
+        "device_ip": request.args.get("device") or None,
+        "limit": request.args.get("limit", 200),
+    }
+
+
+# Fleet-wide interface search, e.g. /interfaces?status=administratively+down
+@app.route("/interfaces")
+def interfaces_page():
+    try:
+        result = db.search_interfaces(**interface_search_args())
+    except ValueError as e:
+        flash(str(e), "warning")
+        return redirect("/interfaces")
+    return render_template("interfaces.html", result=result, args=request.args)
+
+
+@app.route("/api/interfaces")
+def api_interfaces():
+    try:
+        return jsonify(db.search_interfaces(**interface_search_args()))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+
+def not_modified(etag, last_modified):
+    """A 304 response if the client's cached copy is current, else None.
+
+    If-None-Match wins over If-Modified-Since, as RFC 9110 requires.
+    """
+    if request.if_none_match:
+        current = request.if_none_match.contains(etag)
+    else:
+        since = request.if_modified_since
+        current = bool(since and last_modified) and since >= http_time(last_modified)
+    if not current:
+        return None
+    return with_validators(app.response_class(status=304), etag, last_modified)
+
+
+def with_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = http_time(last_modified)
+    # Cacheable by the browser only, and revalidated on every use
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def http_time(timestamp):
+    """A naive UTC datetime from Mongo at the seconds precision of HTTP dates."""
+    return timestamp.replace(tzinfo=datetime.timezone.utc, microsecond=0)
 
 
 @app.route("/manage/<ip>")
 def manage_device(ip):
-    router = db.get_device_info(ip)
-    config = db.get_latest_running_config(ip)
-    details = db.get_latest_device_details(ip)  # show version
-    interfaces = db.get_latest_interface_status(ip)  # show ip interface brief
-    vrfs = db.get_latest_vrf_details(ip)  # show vrf
-    running_configs = db.get_latest_running_config(ip)  # show running config
-
-    return render_template(
-        "manage_devices.html",
-        ip=ip,
-        router=router,
-        config=config,
-        details=details,
-        interfaces=interfaces,
-        vrfs=vrfs,
-        running_configs=running_configs,
+    # One aggregation (cached in-process) feeds every panel below
+    page = db.get_device_page(ip)
+    cached = not_modified(page["etag"], page["last_modified"])
+    if cached:
+        return cached
+
+    response = app.make_response(
+        render_template(
+            "manage_devices.html",
+            ip=ip,
+            router=page["device"],
+            config=page["config"],
+            details=page["details"],  # show version
+            interfaces=page["interfaces"],  # show ip interface brief
+            vrfs=page["vrfs"],  # show vrf
+        )
     )
+    return with_validators(response, page["etag"], page["last_modified"])
+
 
+def stream_device_events(ip, subscriber):
+    """Server-Sent Events for one device page, until the client leaves."""
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                event, payload = subscriber.get(timeout=LIVE_KEEPALIVE)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
+    finally:
+        live.get_device_events().unsubscribe(ip, subscriber)
+
+
+# Live updates of the device page: interfaces, version and config events
+@app.route("/manage/<ip>/events")
+def device_events(ip):
+    subscriber = live.get_device_events().subscribe(ip)
+    return Response(
+        stream_device_events(ip, subscriber),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-# Save Changes button route
-# ADD THIS NEW ROUTE
+
+# Save Changes button route: the push runs on the worker, so the request
+# returns at once with a job to poll on /jobs/<job_id>
 @app.route("/manage/<ip>/update_interfaces", methods=["POST"])
 def update_interfaces(ip):
     # Get the list of updates from the frontend
     # e.g., [ {"name": "eth01", "enabled": True}, ... ]
     updates = request.json.get("interfaces", [])
 
-    # 1. Get device credentials from DB
-    # (Using get_router_info as it's defined in your db.py)
-    device = db.get_device_info(ip)
-    if not device:
+    if not db.get_device_info(ip):
         return jsonify({"status": "error", "message": "Device not found"}), 404
 
-    # Prepare Netmiko-compatible device dictionary
-    host = device.get("ip") or device.get("host")
-    if not host:
-        return (
-            jsonify(
-                {"status": "error", "message": "Device IP/host not found in database."}
-            ),
-            400,
-        )
-
-    netmiko_device = {
-        "device_type": "cisco_ios",  # You should make this dynamic from device.get('device_type')
-        "host": host,
-        "username": device.get("username"),
-        "password": device.get("password"),
-    }
-
-    # 2. Build the configuration commands
+    # Build the configuration commands
     config_commands = []
     for update in updates:
         iface_name = update.get("name")
-        is_enabled = update.get("enabled")
-
+        if not iface_name:
+            continue
         config_commands.append(f"interface {iface_name}")
-        if is_enabled:
+        if update.get("enabled"):
             config_commands.append("no shutdown")
         else:
             config_commands.append("shutdown")
+    if not config_commands:
+        return jsonify({"status": "error", "message": "No interface changes"}), 400
 
+    job_id = db.create_config_job(ip, config_commands, updates)
     try:
-        # 3. Apply changes to the actual device
-        with ConnectHandler(**netmiko_device) as conn:
-            conn.send_config_set(config_commands)
-            # Fetch real interface status after config
-            interfaces_output = conn.send_command(
-                "show ip interface brief", use_textfsm=True
-            )
-
-        # Parse and update DB with real status
-        # interfaces_output is a list of dicts if TextFSM template is available
-        real_status = []
-        if isinstance(interfaces_output, list):
-            for iface in interfaces_output:
-                real_status.append(
-                    {
-                        "name": iface.get("intf", iface.get("interface", "")),
-                        "status": iface.get("status", ""),
-                        "ip": iface.get("ipaddr", iface.get("ip_address", "")),
-                        "enabled": iface.get("status", "").lower() == "up",
-                    }
-                )
-            # Optionally update DB with real status (if you have a function for this)
-            if hasattr(db, "update_interface_statuses"):
-                db.update_interface_statuses(ip, real_status)
-        else:
-            # Fallback: just update with requested states
-            db.update_interface_statuses(ip, updates)
-
-        return jsonify(
-            {
-                "status": "success",
-                "message": "Changes applied and saved.",
-                "interfaces": real_status if real_status else updates,
-            }
+        jobs.get_publisher().publish_config_job(job_id, ip)
+    except pika.exceptions.AMQPError as e:
+        print(f"Could not queue config job {job_id}: {e!r}")
+        db.fail_config_jobs([job_id], "Could not queue the job")
+        return (
+            jsonify({"status": "error", "message": "Job queue unavailable"}),
+            503,
         )
 
-    except Exception as e:
-        print(f"Error applying interface config: {e}")
-        return jsonify({"status": "error", "message": str(e)}), 500
+    status_url = url_for("config_job_status", job_id=job_id)
+    response = jsonify({"status": "queued", "job_id": job_id, "status_url": status_url})
+    response.headers["Location"] = status_url
+    return response, 202
+
+
+# Config job status: queued -> running -> succeeded | failed
+@app.route("/jobs/<job_id>", methods=["GET"])
+def config_job_status(job_id):
+    job = db.get_config_job(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    job["job_id"] = job.pop("_id")
+    return jsonify(job)
 
 
 # End of Save Changes button route
 
 
+def ndjson(record):
+    return json.dumps(record) + "\n"
+
+
+def stream_config_batch(batch_id, job_ips):
+    """NDJSON lines: the queued batch, then each device's result as it ends.
+
+    Ends with a "done" line once every device has finished, or a "timeout"
+    line listing the devices still pending; their results remain available
+    from /bulk/config/<batch_id>.
+    """
+    yield ndjson(
+        {"event": "queued", "batch_id": batch_id, "devices": sorted(job_ips.values())}
+    )
+    reported = set()
+    counts = {"succeeded": 0, "failed": 0}
+    deadline = time.monotonic() + BULK_STREAM_TIMEOUT
+    while True:
+        for job in db.get_config_batch(batch_id, finished_only=True, exclude=reported):
+            reported.add(job["_id"])
+            counts[job["status"]] += 1
+            yield ndjson(
+                {
+                    "event": "result",
+                    "ip": job["ip"],
+                    "job_id": job["_id"],
+                    "status": job["status"],
+                    "message": job.get("message"),
+                    "interfaces": job.get("interfaces"),
+                }
+            )
+        if len(reported) == len(job_ips):
+            yield ndjson({"event": "done", "batch_id": batch_id, **counts})
+            return
+        if time.monotonic() > deadline:
+            pending = [ip for job_id, ip in job_ips.items() if job_id not in reported]
+            yield ndjson({"event": "timeout", "batch_id": batch_id, "pending": pending})
+            return
+        time.sleep(BULK_POLL_INTERVAL)
+
+
+def string_list(data, key):
+    """data[key] as a non-empty list of strings, None if absent.
+
+    Raises ValueError for anything else, e.g. a bare string, which $in
+    would otherwise treat as a list of characters.
+    """
+    value = data.get(key)
+    if value is None:
+        return None
+    if (
+        not isinstance(value, list)
+        or not value
+        or not all(isinstance(item, str) for item in value)
+    ):
+        raise ValueError(f"'{key}' must be a non-empty list of strings")
+    return value
+
+
+def bulk_config_args(data):
+    """select_device_ips() keyword arguments and the commands of a
+    /bulk/config body; raises ValueError for a malformed one."""
+    if not isinstance(data, dict):
+        raise ValueError("expected a JSON object")
+    for key in ("type", "q"):
+        if data.get(key) is not None and not isinstance(data[key], str):
+            raise ValueError(f"'{key}' must be a string")
+    commands = [line for line in string_list(data, "commands") or [] if line.strip()]
+    if not commands:
+        raise ValueError("No commands provided.")
+    selector = {
+        "ips": string_list(data, "ips"),
+        "device_type": data.get("type"),
+        "hostname": data.get("q"),
+    }
+    return selector, commands
+
+
+# Bulk config push: POST {"ips": [...]} or {"type": "switch", "q": "SW"} plus
+# "commands" (a list of config lines); one config job per device runs on the
+# workers, in parallel up to their CONFIG_PUSH_CONCURRENCY, and results
+# stream back as NDJSON
+@app.route("/bulk/config", methods=["POST"])
+def bulk_config():
+    try:
+        selector, commands = bulk_config_args(request.get_json(silent=True) or {})
+        ips = db.select_device_ips(**selector)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if not ips:
+        return jsonify({"status": "error", "message": "No matching devices."}), 404
+    if len(ips) > BULK_MAX_DEVICES:
+        message = f"{len(ips)} devices selected, at most {BULK_MAX_DEVICES} allowed."
+        return jsonify({"status": "error", "message": message}), 400
+
+    batch_id, job_ips = db.create_config_batch(ips, commands)
+    # Devices that could not be queued are reported as failed in the stream
+    unqueued = jobs.get_publisher().publish_config_jobs(job_ips)
+    if unqueued:
+        db.fail_config_jobs(unqueued, "Could not queue the job")
+
+    return Response(
+        stream_with_context(stream_config_batch(batch_id, job_ips)),
+        mimetype="application/x-ndjson",
+        # Let results through proxies as they come
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/bulk/config/<batch_id>", methods=["GET"])
+def bulk_config_status(batch_id):
+    batch = db.get_config_batch(batch_id)
+    if not batch:
+        return jsonify({"status": "error", "message": "Batch not found"}), 404
+    counts = collections.Counter(job["status"] for job in batch)
+    for job in batch:
+        job["job_id"] = job.pop("_id")
+    return jsonify({"batch_id": batch_id, "counts": counts, "jobs": batch})
+
+
 # Download the configuration file
 @app.route("/download_config/<ip>", methods=["GET"])
 def download_config(ip):
     try:
-        config = db.get_latest_running_config(ip)
+        page = db.get_device_page(ip)
+        config = page["config"]
 
         if (
             config == "No configuration found"
@@ -175,18 +417,61 @@ def download_config(ip):
         ):
             return jsonify({"status": "error", "message": config}), 404
 
-        device_info = db.get_device_info(ip)
+        # Configs are content-addressed, so their hash is a strong validator.
+        # device_state.config_time is the worker's ISO string, so the date
+        # is the state's last update: a poll that found the same config
+        # still revalidates through the hash.
+        etag = page["config_hash"] or page["etag"]
+        last_modified = page["updated_at"] or page["last_modified"]
+        cached = not_modified(etag, last_modified)
+        if cached:
+            return cached
+
+        device_info = page["device"]
         hostname = device_info.get("hostname", "device") if device_info else "device"
 
         # Create filename: hostname_ip_running-config.txt
         filename = f"{hostname}_{ip}_running-config.txt"
 
-        return jsonify({"status": "ok", "filename": filename, "config": config})
+        response = jsonify({"status": "ok", "filename": filename, "config": config})
+        return with_validators(response, etag, last_modified)
     except Exception as e:
         print(f"Error downloading config: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+# Running-config history: versions are stored once per distinct config
+@app.route("/manage/<ip>/configs", methods=["GET"])
+def config_versions(ip):
+    return jsonify({"status": "ok", "versions": db.get_config_versions(ip)})
+
+
+@app.route("/manage/<ip>/configs/<config_hash>", methods=["GET"])
+def config_version(ip, config_hash):
+    config = db.get_config_version(config_hash)
+    if config is None:
+        return jsonify({"status": "error", "message": "Version not found"}), 404
+    return jsonify({"status": "ok", "config_hash": config_hash, "config": config})
+
+
+# Diff two versions: ?from=<hash>&to=<hash>, defaulting to the two newest
+@app.route("/manage/<ip>/configs/diff", methods=["GET"])
+def config_diff(ip):
+    from_hash = request.args.get("from")
+    to_hash = request.args.get("to")
+    if not from_hash or not to_hash:
+        versions = [v["config_hash"] for v in db.get_config_versions(ip)]
+        if len(versions) < 2:
+            return jsonify({"status": "ok", "diff": ""})
+        to_hash = to_hash or versions[0]
+        from_hash = from_hash or versions[1]
+
+    diff = db.diff_config_versions(from_hash, to_hash)
+    if diff is None:
+        return jsonify({"status": "error", "message": "Version not found"}), 404
+    return jsonify({"status": "ok", "from": from_hash, "to": to_hash, "diff": diff})
+
+
 # Ping endpoint: POST /manage/<ip>/ping
 @app.route("/manage/<ip>/ping", methods=["POST"])
 def ping_from_router(ip):
@@ -196,6 +481,8 @@ def ping_from_router(ip):
         return jsonify({"status": "error", "message": "No target IP provided."}), 400
 
     device = db.get_device_info(ip)
+    if not device:
+        return jsonify({"status": "error", "message": "Device not found"}), 404
     host = device.get("ip") or device.get("host")
     if not host:
         return (
@@ -205,22 +492,21 @@ def ping_from_router(ip):
             400,
         )
 
-    netmiko_device = {
-        "device_type": "cisco_ios",
-        "host": host,
-        "username": device.get("username"),
-        "password": device.get("password"),
-    }
+    ping_cmd = f"ping {target_ip}"
     try:
-        with ConnectHandler(**netmiko_device) as conn:
-            ping_cmd = f"ping {target_ip}"
+        # Reuses the device's warm session; concurrent clicks take turns
+        with sessions.get_sessions().session(
+            host, device.get("username"), device.get("password")
+        ) as conn:
             output = conn.send_command(ping_cmd)
-        # Save to MongoDB outputs collection
-        db.save_command_output(ip, ping_cmd, output, success=True)
-        return jsonify({"status": "ok", "output": output})
+    except sessions.DeviceBusy as e:
+        return jsonify({"status": "error", "message": str(e)}), 429
     except Exception as e:
-        db.save_command_output(ip, f"ping {target_ip}", str(e), success=False)
+        db.save_command_output(ip, ping_cmd, str(e), success=False)
         return jsonify({"status": "error", "message": str(e)}), 500
+    # Save to MongoDB outputs collection
+    db.save_command_output(ip, ping_cmd, output, success=True)
+    return jsonify({"status": "ok", "output": output})
 
 
 if __name__ == "__main__":
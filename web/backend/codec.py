@@ -0,0 +1,61 @@
+"""Transparent compression of large text payloads stored in MongoDB.
+
+worker/codec.py and web/backend/codec.py are identical copies, since the
+services are built into separate images; keep them in sync.
+"""
+
+import os
+import zlib
+
+from bson.binary import Binary
+
+try:
+    import zstandard
+except ImportError:  # optional, zlib is always available
+    zstandard = None
+
+# Text shorter than this many bytes is stored as-is
+COMPRESS_THRESHOLD = int(os.getenv("COMPRESS_THRESHOLD", "4096"))
+# "zlib" or "zstd" (needs the zstandard package wherever payloads are read)
+COMPRESS_CODEC = os.getenv("COMPRESS_CODEC", "zlib")
+
+
+def encode(value):
+    """Compress a large string into a tagged binary document.
+
+    Anything that is not a string, or is below COMPRESS_THRESHOLD, is
+    returned unchanged, so encode() can be applied to any stored field.
+    """
+    if not isinstance(value, str):
+        return value
+    raw = value.encode("utf-8")
+    if len(raw) < COMPRESS_THRESHOLD:
+        return value
+    if COMPRESS_CODEC == "zstd" and zstandard is not None:
+        codec = "zstd"
+        data = zstandard.ZstdCompressor().compress(raw)
+    else:
+        codec = "zlib"
+        data = zlib.compress(raw, 6)
+    return {"codec": codec, "size": len(raw), "data": Binary(data)}
+
+
+def is_encoded(value):
+    return isinstance(value, dict) and "codec" in value and "data" in value
+
+
+def decode(value):
+    """Return the original string of an encode()d value; others pass through."""
+    if not is_encoded(value):
+        return value
+    if value["codec"] == "zlib":
+        raw = zlib.decompress(value["data"])
+    elif value["codec"] == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd payloads")
+        raw = zstandard.ZstdDecompressor().decompress(
+            value["data"], max_output_size=value["size"]
+        )
+    else:
+        raise ValueError(f"Unknown payload codec '{value['codec']}'")
+    return raw.decode("utf-8")
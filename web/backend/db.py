@@ -1,81 +1,369 @@
+import base64
+import collections
 import datetime
-from flask import g
-from pymongo import MongoClient
+import difflib
+import hashlib
+import re
+import time
+import uuid
+from bson import json_util
+from pymongo import ASCENDING, DESCENDING, IndexModel, MongoClient
+from pymongo.errors import DuplicateKeyError, PyMongoError
 import os
+import threading
+import codec
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Pool and timeout settings of the shared client; fail fast instead of
+# hanging a request when MongoDB is unreachable
+CLIENT_OPTIONS = {
+    "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+    "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+    "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000")),
+    "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000")),
+    "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+    "serverSelectionTimeoutMS": int(
+        os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")
+    ),
+}
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+# Device pages are reused for PAGE_CACHE_TTL seconds, then revalidated
+# against device_state.updated_at, which the worker bumps on every write
+PAGE_CACHE_TTL = float(os.getenv("PAGE_CACHE_TTL", "5"))
+PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", "512"))
+
+_page_cache = collections.OrderedDict()
+_page_cache_lock = threading.Lock()
+
+
+def parse_retention(spec):
+    """Parse "show ip interface brief=7,show version=30" into {command: days}."""
+    days = {}
+    for item in (spec or "").split(","):
+        if "=" in item:
+            command, value = item.rsplit("=", 1)
+            days[command.strip()] = float(value)
+    return days
+
+
+# Days the raw history of a command (or first word, e.g. "ping") is kept;
+# same format and default as the worker (worker/database.py)
+RETENTION_DAYS = parse_retention(
+    os.getenv("RETENTION_DAYS", "show ip interface brief=7,show version=30")
+)
+
+# Days a finished or abandoned config-push job stays queryable
+CONFIG_JOB_RETENTION_DAYS = float(os.getenv("CONFIG_JOB_RETENTION_DAYS", "7"))
+# Seconds a job may stay running before its worker is presumed dead
+CONFIG_JOB_TIMEOUT = float(os.getenv("CONFIG_JOB_TIMEOUT", "600"))
+
+# Declared indexes per collection, ensured at startup by ensure_indexes()
+INDEXES = {
+    # Serves the get_latest_* lookups: newest successful output of a command
+    "outputs": [
+        IndexModel(
+            [
+                ("ip_address", ASCENDING),
+                ("command", ASCENDING),
+                ("success", ASCENDING),
+                ("time", DESCENDING),
+            ],
+            name="latest_output",
+        ),
+        # TTL: entries are removed once their retention-derived expire_at passes
+        IndexModel(
+            [("expire_at", ASCENDING)], expireAfterSeconds=0, name="expire_at_ttl"
+        ),
+        IndexModel(
+            [("command", ASCENDING), ("created_at", ASCENDING)], name="command_created"
+        ),
+    ],
+    # Device lookups by IP, and the guard against adding a device twice
+    "devices": [
+        IndexModel([("ip", ASCENDING)], unique=True, name="unique_ip"),
+        # Device list filters and sort orders (list_devices)
+        IndexModel([("device_type", ASCENDING), ("ip", ASCENDING)], name="type_ip"),
+        IndexModel(
+            [("hostname_lower", ASCENDING), ("_id", ASCENDING)], name="hostname_lower"
+        ),
+    ],
+    # Latest state per device, written by the worker
+    "device_state": [
+        IndexModel([("ip_address", ASCENDING)], unique=True, name="unique_ip_address")
+    ],
+    # Hourly interface up/down summaries, written by the scheduler's rollup job
+    "interface_rollups": [
+        IndexModel(
+            [("ip_address", ASCENDING), ("interface", ASCENDING), ("hour", ASCENDING)],
+            unique=True,
+            name="device_interface_hour",
+        ),
+        IndexModel(
+            [("expire_at", ASCENDING)], expireAfterSeconds=0, name="expire_at_ttl"
+        ),
+    ],
+    # Latest interface table of every device, flattened by the worker
+    "interfaces": [
+        IndexModel(
+            [("device_ip", ASCENDING), ("interface", ASCENDING)],
+            unique=True,
+            name="unique_device_interface",
+        ),
+        IndexModel([("status", ASCENDING), ("proto", ASCENDING)], name="status_proto"),
+        IndexModel([("proto", ASCENDING)], name="proto"),
+        IndexModel([("ip_address", ASCENDING)], name="ip_address"),
+    ],
+    # Config pushes run by the worker; see create_config_job()
+    "config_jobs": [
+        IndexModel([("ip", ASCENDING), ("created_at", DESCENDING)], name="ip_created"),
+        IndexModel(
+            [("batch_id", ASCENDING), ("created_at", ASCENDING)],
+            name="batch_created",
+            partialFilterExpression={"batch_id": {"$type": "string"}},
+        ),
+        IndexModel(
+            [("expire_at", ASCENDING)], expireAfterSeconds=0, name="expire_at_ttl"
+        ),
+    ],
+}
+
+# device_state field holding the latest successful output of each command;
+# running configs are referenced by 'config_hash' into config_blobs
+STATE_FIELDS = {
+    "show ip interface brief": "interfaces",
+    "show version": "version",
+}
+
 
 # Save command output to outputs collection
 def save_command_output(ip, command, output, success=True):
     db = get_db()
-    db["outputs"].insert_one(
-        {
-            "ip_address": ip,
-            "command": command,
-            "output": output,
-            "success": success,
-            "time": datetime.datetime.utcnow(),
-        }
-    )
+    now = datetime.datetime.utcnow()
+    document = {
+        "ip_address": ip,
+        "command": command,
+        "output": codec.encode(output),
+        "success": success,
+        "time": now,
+        "created_at": now,
+    }
+    # Same retention policy as the worker's history (see RETENTION_DAYS)
+    days = RETENTION_DAYS.get(command, RETENTION_DAYS.get(command.split(" ", 1)[0]))
+    if days is not None:
+        document["expire_at"] = now + datetime.timedelta(days=days)
+    db["outputs"].insert_one(document)
+
+
+def get_client():
+    """Return the process-wide pooled MongoClient, creating it on first use.
+
+    MongoClient is thread-safe, so one client serves every request thread.
+    It is not fork-safe: a worker process forked from a parent that already
+    held a client (e.g. gunicorn --preload) builds its own instead.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = MongoClient(os.getenv("MONGODB_URI"), **CLIENT_OPTIONS)
+                _client_pid = pid
+                print(f"✅ MongoDB client ready (pid {pid})")
+    return _client
 
 
 def get_db():
-    if "db" not in g:
-        mongo_uri = os.getenv("MONGODB_URI")
-        db_name = os.getenv("DB_NAME")
+    return get_client()[os.getenv("DB_NAME")]
 
-        client = MongoClient(mongo_uri)
-        g.mongo_client = client
-        g.db = client[db_name]
-        print(f"✅ Connected to MongoDB at {mongo_uri}, using database '{db_name}'")
 
-    return g.db
+def ensure_indexes():
+    """Create the declared indexes; existing ones are left untouched."""
+    db = get_db()
+    for collection, indexes in INDEXES.items():
+        try:
+            db[collection].create_indexes(indexes)
+        except PyMongoError as e:
+            # e.g. duplicate device IPs already stored block the unique index
+            print(f"Could not create indexes on '{collection}': {e}")
 
 
-def close_db(e=None):
-    client = getattr(g, "mongo_client", None)
-    if client is not None:
-        client.close()
-        print("❌ MongoDB connection closed.")
-        g.pop("mongo_client", None)
-        g.pop("db", None)
+def get_index_usage():
+    """Return $indexStats for every collection with declared indexes."""
+    db = get_db()
+    return {
+        collection: list(db[collection].aggregate([{"$indexStats": {}}]))
+        for collection in INDEXES
+    }
 
 
 def add_device(ip, username, password, device_type):
     db = get_db()
     devices = db["devices"]
 
-    # Prevent duplicates
-    if devices.find_one({"ip": ip}):
-        return False
-
     device_data = {
         "ip": ip,
         "username": username,
         "password": password,
         "device_type": device_type,
         "hostname": "",
+        "hostname_lower": "",
         "firmware": "",
         "running_config": "",
         "uptime": "",
         "interfaces": [],
         "vrfs": [],
+        # Lets the scheduler pick up the new device without a full reload
+        "updated_at": datetime.datetime.utcnow(),
     }
-    devices.insert_one(device_data)
+    try:
+        devices.insert_one(device_data)
+    except DuplicateKeyError:
+        # The unique index on 'ip' rejects devices that already exist
+        return False
     return True
 
 
-def get_all_devices():
-    db = get_db()
-    devices = db["devices"]
+# Fields the device list shows; credentials, configs etc. never leave Mongo
+DEVICE_LIST_PROJECTION = {
+    "ip": 1,
+    "hostname": 1,
+    "hostname_lower": 1,
+    "name": 1,
+    "device_type": 1,
+}
+# Sort order -> indexed field it sorts on; the worker keeps hostname_lower
+# in step with the hostname reported by show version
+DEVICE_LIST_SORTS = {"ip": "ip", "hostname": "hostname_lower"}
+DEVICE_TYPES = ("router", "switch")
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(value, object_id):
+    raw = json_util.dumps([value, object_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for a malformed cursor."""
+    try:
+        value, object_id = json_util.loads(base64.urlsafe_b64decode(cursor))
+    except Exception as e:
+        raise ValueError(f"invalid cursor: {e}")
+    return value, object_id
+
 
-    routers = list(devices.find({"device_type": "router"}))
-    switches = list(devices.find({"device_type": "switch"}))
-    others = list(devices.find({"device_type": {"$nin": ["router", "switch"]}}))
+def _type_filter(device_type):
+    if device_type in DEVICE_TYPES:
+        return {"device_type": device_type}
+    return {"device_type": {"$nin": list(DEVICE_TYPES)}}
 
-    return {"routers": routers, "switches": switches, "others": others}
+
+def _hostname_filter(prefix):
+    """Case-insensitive hostname prefix match on hostname_lower.
+
+    Anchored and case-sensitive on the normalized field, so the index scan
+    is bounded to the prefix.
+    """
+    return {"hostname_lower": {"$regex": "^" + re.escape(prefix.lower())}}
+
+
+def _after_cursor(field, value, object_id, descending):
+    """Match the devices that sort after the (value, _id) of a cursor.
+
+    Devices without a hostname_lower sort first, like null; since $gt/$lt
+    never match null, those are handled explicitly.
+    """
+    beyond = "$lt" if descending else "$gt"
+    if field == "ip":
+        # Unique, so no tie-break on _id is needed
+        return {"ip": {beyond: value}}
+    after = [{field: value, "_id": {beyond: object_id}}]
+    if value is None:
+        if not descending:
+            after.append({field: {"$ne": None}})
+    else:
+        after.append({field: {beyond: value}})
+        if descending:
+            after.append({field: None})
+    return {"$or": after}
+
+
+def list_devices(
+    device_type=None, hostname=None, sort="ip", descending=False, limit=50, cursor=None
+):
+    """One page of the device list.
+
+    'device_type' is "router", "switch", "other" or None for all devices;
+    'hostname' filters on a case-insensitive hostname prefix; sorting by
+    hostname ignores case as well. Pages are
+    keyed on the (sort field, _id) of the last item, so deep pages cost the
+    same as the first: the page is one find on the devices indexes, the
+    totals one $group over the hostname filter. Returns {"items", "total",
+    "counts", "next"}: 'counts' holds the per-type totals for the hostname
+    filter and 'next' is the cursor of the following page, or None on the
+    last one.
+    """
+    if sort not in DEVICE_LIST_SORTS:
+        raise ValueError(f"cannot sort by {sort!r}")
+    field = DEVICE_LIST_SORTS[sort]
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    direction = DESCENDING if descending else ASCENDING
+    devices = get_db()["devices"]
+
+    match = _hostname_filter(hostname) if hostname else {}
+    query = dict(match)
+    if device_type:
+        query.update(_type_filter(device_type))
+    if cursor:
+        value, object_id = decode_cursor(cursor)
+        query = {"$and": [query, _after_cursor(field, value, object_id, descending)]}
+    order = [(field, direction)]
+    if field != "ip":
+        order.append(("_id", direction))
+    items = list(
+        devices.find(query, DEVICE_LIST_PROJECTION, sort=order, limit=limit + 1)
+    )
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encode_cursor(last.get(field), last["_id"])
+    for item in items:
+        item.pop("_id")
+        item.pop("hostname_lower", None)
+        item["hostname"] = item.get("hostname") or ""
+
+    counts = {device_type: 0 for device_type in (*DEVICE_TYPES, "other")}
+    rows = devices.aggregate(
+        [
+            {"$match": match},
+            {
+                "$group": {
+                    "_id": {
+                        "$cond": [
+                            {"$in": ["$device_type", list(DEVICE_TYPES)]},
+                            "$device_type",
+                            "other",
+                        ]
+                    },
+                    "n": {"$sum": 1},
+                }
+            },
+        ]
+    )
+    counts.update({row["_id"]: row["n"] for row in rows})
+    if device_type:
+        total = counts[device_type if device_type in DEVICE_TYPES else "other"]
+    else:
+        total = sum(counts.values())
+    return {"items": items, "total": total, "counts": counts, "next": next_cursor}
 
 
 def get_device_info(ip):
@@ -84,50 +372,136 @@ def get_device_info(ip):
     return result
 
 
-def get_latest_running_config(ip):
+def get_device_state(ip):
+    """Return the latest per-device state maintained by the worker.
+
+    A single point read on device_state's unique ip_address index.
+    """
+    db = get_db()
+    return db["device_state"].find_one({"ip_address": ip}) or {}
+
+
+def _latest_output(ip, command, state=None):
+    """Latest successful output of 'command', read from the device state.
+
+    Devices that have not been polled since device_state was introduced fall
+    back to the newest matching document in the outputs history.
+    """
+    if state is None:
+        state = get_device_state(ip)
+    field = STATE_FIELDS[command]
+    if field in state:
+        return state[field]
+    db = get_db()
+    result = db["outputs"].find_one(
+        {"ip_address": ip, "command": command, "success": True},
+        sort=[("time", -1)],
+    )
+    return result.get("output") if result else None
+
+
+def get_latest_running_config(ip, state=None):
     db = get_db()
     try:
-        # Fetch latest output for 'show running-config' from outputs collection
-        result = db["outputs"].find_one(
-            {"ip_address": ip, "command": "show running-config", "success": True},
-            sort=[("time", -1)],
-        )
-        if result and "output" in result:
-            return result["output"]
+        if state is None:
+            state = get_device_state(ip)
+        config_hash = state.get("config_hash")
+        if config_hash is None:
+            # Not polled since device_state was introduced: use the history
+            result = db["outputs"].find_one(
+                {"ip_address": ip, "command": "show running-config", "success": True},
+                sort=[("time", -1)],
+            )
+            if not result:
+                return "No configuration found"
+            config_hash = result.get("config_hash")
+            if config_hash is None:
+                # Stored inline before configs were content-addressed
+                return codec.decode(result.get("output"))
+        config = get_config_version(config_hash)
+        if config is not None:
+            return config
         return "No configuration found"
     except Exception as e:
         print(f"Error fetching running config: {e}")
         return "Error fetching configuration"
 
 
-def get_latest_device_details(ip):
+def get_config_version(config_hash):
+    """Return the running-config text stored under 'config_hash', or None."""
     db = get_db()
-    # Fetch latest output for 'show version' from outputs collection
-    result = db["outputs"].find_one(
-        {"ip_address": ip, "command": "show version", "success": True},
-        sort=[("time", -1)],
+    blob = db["config_blobs"].find_one({"_id": config_hash}, {"text": 1})
+    return codec.decode(blob["text"]) if blob else None
+
+
+def get_config_versions(ip):
+    """List the distinct running-config versions seen on a device, newest first.
+
+    Each entry has the config_hash and when that version was first and last
+    seen by the worker.
+    """
+    db = get_db()
+    return list(
+        db["outputs"].aggregate(
+            [
+                {
+                    "$match": {
+                        "ip_address": ip,
+                        "command": "show running-config",
+                        "success": True,
+                        "config_hash": {"$exists": True},
+                    }
+                },
+                {
+                    "$group": {
+                        "_id": "$config_hash",
+                        "first_seen": {"$min": "$time"},
+                        "last_seen": {"$max": "$time"},
+                    }
+                },
+                {"$sort": {"first_seen": -1}},
+                {
+                    "$project": {
+                        "_id": 0,
+                        "config_hash": "$_id",
+                        "first_seen": 1,
+                        "last_seen": 1,
+                    }
+                },
+            ]
+        )
+    )
+
+
+def diff_config_versions(from_hash, to_hash):
+    """Unified diff between two stored running-config versions, or None."""
+    old = get_config_version(from_hash)
+    new = get_config_version(to_hash)
+    if old is None or new is None:
+        return None
+    return "".join(
+        difflib.unified_diff(
+            old.splitlines(keepends=True),
+            new.splitlines(keepends=True),
+            fromfile=from_hash,
+            tofile=to_hash,
+        )
     )
-    if (
-        result
-        and "output" in result
-        and isinstance(result["output"], list)
-        and result["output"]
-    ):
+
+
+def get_latest_device_details(ip, state=None):
+    output = _latest_output(ip, "show version", state)
+    if isinstance(output, list) and output:
         # Return the first dict in the output list (as per worker format)
-        return result["output"][0]
+        return output[0]
     return {}
 
 
-def get_latest_interface_status(ip):
-    db = get_db()
-    # Fetch latest output for 'show ip interface brief' from outputs collection
-    result = db["outputs"].find_one(
-        {"ip_address": ip, "command": "show ip interface brief", "success": True},
-        sort=[("time", -1)],
-    )
-    if result and "output" in result and isinstance(result["output"], list):
+def get_latest_interface_status(ip, state=None):
+    output = _latest_output(ip, "show ip interface brief", state)
+    if isinstance(output, list):
         interfaces = []
-        for iface in result["output"]:
+        for iface in output:
             interfaces.append(
                 {
                     "name": iface.get("interface", ""),
@@ -141,39 +515,270 @@ def get_latest_interface_status(ip):
     return []
 
 
+def _device_page_pipeline(ip):
+    """The device, its state and its current config blob in one roundtrip."""
+    return [
+        {"$match": {"ip": ip}},
+        {"$limit": 1},
+        {
+            "$lookup": {
+                "from": "device_state",
+                "localField": "ip",
+                "foreignField": "ip_address",
+                "as": "state",
+            }
+        },
+        {"$unwind": {"path": "$state", "preserveNullAndEmptyArrays": True}},
+        {
+            "$lookup": {
+                "from": "config_blobs",
+                "localField": "state.config_hash",
+                "foreignField": "_id",
+                "as": "config_blob",
+            }
+        },
+    ]
+
+
+def _load_device_page(ip):
+    doc = next(get_db()["devices"].aggregate(_device_page_pipeline(ip)), None)
+    if doc is None:
+        # Unknown device: the state may still exist from an earlier poll
+        device, state, blobs = None, get_device_state(ip), []
+    else:
+        state = doc.pop("state", None) or {}
+        blobs = doc.pop("config_blob", [])
+        device = doc
+    if blobs:
+        config = codec.decode(blobs[0]["text"])
+    else:
+        # Not polled since configs were content-addressed: use the history
+        config = get_latest_running_config(ip, state)
+
+    updated_at = state.get("updated_at")
+    device_updated_at = device.get("updated_at") if device else None
+    validators = f"{ip}|{updated_at}|{device_updated_at}|{state.get('config_hash')}"
+    return {
+        "device": device,
+        "config": config,
+        "config_hash": state.get("config_hash"),
+        "details": get_latest_device_details(ip, state),
+        "interfaces": get_latest_interface_status(ip, state),
+        "vrfs": device.get("vrfs", []) if device else [],
+        "updated_at": updated_at,
+        "etag": hashlib.sha1(validators.encode()).hexdigest(),
+        "last_modified": max(
+            (t for t in (updated_at, device_updated_at) if t), default=None
+        ),
+    }
+
+
+def get_device_page(ip):
+    """Everything the device page shows, from one aggregation.
+
+    Pages are cached in-process. Within PAGE_CACHE_TTL seconds a page is
+    served as is; after that one indexed read of device_state.updated_at
+    decides whether it is still current or has to be reloaded. The page's
+    'etag' and 'last_modified' serve HTTP conditional requests.
+    """
+    now = time.monotonic()
+    with _page_cache_lock:
+        entry = _page_cache.get(ip)
+    if entry is not None:
+        expires, page = entry
+        if now < expires:
+            return page
+        state = get_db()["device_state"].find_one(
+            {"ip_address": ip}, {"_id": 0, "updated_at": 1}
+        )
+        if (state or {}).get("updated_at") == page["updated_at"]:
+            _cache_device_page(ip, page, now)
+            return page
+    page = _load_device_page(ip)
+    _cache_device_page(ip, page, now)
+    return page
+
+
+def _cache_device_page(ip, page, now):
+    with _page_cache_lock:
+        _page_cache[ip] = (now + PAGE_CACHE_TTL, page)
+        _page_cache.move_to_end(ip)
+        while len(_page_cache) > PAGE_CACHE_SIZE:
+            _page_cache.popitem(last=False)
+
+
 def get_latest_vrf_details(ip):
     db = get_db()
     result = db["devices"].find_one({"ip": ip}, {"vrfs": 1})
     return result.get("vrfs", []) if result else []
 
 
-# Add this new function to db.py
-def update_interface_statuses(ip, updates):
+def _config_job(ip, commands, now, updates=None, batch_id=None):
+    return {
+        "_id": uuid.uuid4().hex,
+        "ip": ip,
+        "commands": commands,
+        "updates": updates,
+        "batch_id": batch_id,
+        "status": "queued",
+        "created_at": now,
+        "updated_at": now,
+        "expire_at": now + datetime.timedelta(days=CONFIG_JOB_RETENTION_DAYS),
+    }
+
+
+def create_config_job(ip, commands, updates):
+    """Record a queued config push for the worker and return its id.
+
+    'commands' are the config lines to send and 'updates' the interface
+    changes they came from, reported back if the device's interfaces cannot
+    be read after the push.
     """
-    Updates the 'enabled' status for multiple interfaces on a single device.
-    'updates' should be a list of dicts, e.g.,
-    [ {"name": "eth01", "enabled": True}, {"name": "eth03", "enabled": False} ]
+    job = _config_job(ip, commands, datetime.datetime.utcnow(), updates=updates)
+    get_db()["config_jobs"].insert_one(job)
+    return job["_id"]
+
+
+def create_config_batch(ips, commands):
+    """Record one queued config push per device under a shared batch id.
+
+    Returns (batch_id, {job_id: ip}).
     """
-    db = get_db()
-    devices = db["devices"]
+    now = datetime.datetime.utcnow()
+    batch_id = uuid.uuid4().hex
+    jobs = [_config_job(ip, commands, now, batch_id=batch_id) for ip in ips]
+    get_db()["config_jobs"].insert_many(jobs, ordered=False)
+    return batch_id, {job["_id"]: job["ip"] for job in jobs}
 
-    try:
-        # Loop through each update provided from the frontend
-        for update in updates:
-            iface_name = update.get("name")
-            is_enabled = update.get("enabled")
-
-            if not iface_name:
-                continue
-
-            # This command finds the document by IP,
-            # then finds the element in the 'interfaces' array with the matching name,
-            # and sets its 'enabled' field to the new value.
-            devices.update_one(
-                {"ip": ip, "interfaces.name": iface_name},
-                {"$set": {"interfaces.$.enabled": is_enabled}},
-            )
-        return True
-    except Exception as e:
-        print(f"Error updating interface statuses in DB: {e}")
-        return False
+
+def fail_config_jobs(job_ids, message):
+    now = datetime.datetime.utcnow()
+    get_db()["config_jobs"].update_many(
+        {"_id": {"$in": list(job_ids)}},
+        {
+            "$set": {
+                "status": "failed",
+                "message": message,
+                "finished_at": now,
+                "updated_at": now,
+            }
+        },
+    )
+
+
+def _fail_stale_config_jobs(query):
+    """Fail the jobs matching 'query' that have run for CONFIG_JOB_TIMEOUT.
+
+    A worker that dies mid-push never finishes its job, and the redelivered
+    message does not run it again (see the worker's claim_config_job).
+    """
+    now = datetime.datetime.utcnow()
+    get_db()["config_jobs"].update_many(
+        {
+            **query,
+            "status": "running",
+            "started_at": {"$lt": now - datetime.timedelta(seconds=CONFIG_JOB_TIMEOUT)},
+        },
+        {
+            "$set": {
+                "status": "failed",
+                "message": "The worker stopped responding; check the device.",
+                "finished_at": now,
+                "updated_at": now,
+            }
+        },
+    )
+
+
+def get_config_job(job_id):
+    """Status of a config push; credentials and commands are left out."""
+    _fail_stale_config_jobs({"_id": job_id})
+    return get_db()["config_jobs"].find_one(
+        {"_id": job_id}, {"commands": 0, "expire_at": 0}
+    )
+
+
+def get_config_batch(batch_id, finished_only=False, exclude=()):
+    """Jobs of a config batch, oldest first, without their commands.
+
+    'exclude' skips job ids the caller has already seen.
+    """
+    _fail_stale_config_jobs({"batch_id": batch_id})
+    query = {"batch_id": batch_id}
+    if finished_only:
+        query["status"] = {"$in": ["succeeded", "failed"]}
+    if exclude:
+        query["_id"] = {"$nin": list(exclude)}
+    return list(
+        get_db()["config_jobs"]
+        .find(query, {"commands": 0, "updates": 0, "expire_at": 0})
+        .sort("created_at", ASCENDING)
+    )
+
+
+def select_device_ips(ips=None, device_type=None, hostname=None):
+    """IPs of the devices matching a bulk-action selector.
+
+    'ips' picks devices explicitly; 'device_type' and 'hostname' (a
+    case-insensitive prefix) filter the same way as the device list.
+    """
+    query = {}
+    if ips:
+        query["ip"] = {"$in": list(ips)}
+    if device_type:
+        query.update(_type_filter(device_type))
+    if hostname:
+        query.update(_hostname_filter(hostname))
+    if not query:
+        raise ValueError("select devices by ips, type or hostname")
+    return [
+        device["ip"]
+        for device in get_db()["devices"]
+        .find(query, {"_id": 0, "ip": 1})
+        .sort("ip", ASCENDING)
+    ]
+
+
+def search_interfaces(
+    status=None, proto=None, ip_address=None, interface=None, device_ip=None, limit=200
+):
+    """Interfaces across the fleet matching every given filter.
+
+    'status' and 'proto' match exactly ("administratively down", "down",
+    ...). 'ip_address' matches exactly, or as a prefix when it ends with a
+    dot ("10.1.2."); 'interface' is a case-insensitive name prefix. Returns
+    {"items", "total"}; items carry their device's hostname.
+    """
+    query = {}
+    if status:
+        query["status"] = status
+    if proto:
+        query["proto"] = proto
+    if ip_address:
+        if ip_address.endswith("."):
+            query["ip_address"] = {"$regex": "^" + re.escape(ip_address)}
+        else:
+            query["ip_address"] = ip_address
+    if interface:
+        query["interface"] = {"$regex": "^" + re.escape(interface), "$options": "i"}
+    if device_ip:
+        query["device_ip"] = device_ip
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE * 5))
+
+    db = get_db()
+    items = list(
+        db["interfaces"]
+        .find(query, {"_id": 0})
+        .sort([("device_ip", ASCENDING), ("interface", ASCENDING)])
+        .limit(limit)
+    )
+    hostnames = {
+        device["ip"]: device.get("hostname", "")
+        for device in db["devices"].find(
+            {"ip": {"$in": list({item["device_ip"] for item in items})}},
+            {"_id": 0, "ip": 1, "hostname": 1},
+        )
+    }
+    for item in items:
+        item["hostname"] = hostnames.get(item["device_ip"], "")
+    return {"items": items, "total": db["interfaces"].count_documents(query)}
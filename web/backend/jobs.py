@@ -0,0 +1,113 @@
+"""Publishing config-push jobs to the worker over RabbitMQ.
+
+Messages only carry the id of the job's config_jobs document and the
+device's IP, by which the worker orders pushes; the worker reads the
+commands from the document and reports progress back into it.
+"""
+
+import json
+import os
+import threading
+
+import pika
+
+EXCHANGE = "jobs"
+CONFIG_QUEUE = os.getenv("RABBITMQ_CONFIG_QUEUE", "config_jobs")
+CONFIG_ROUTING_KEY = "config_push"
+
+
+class JobPublisher:
+    """One long-lived, confirmed channel shared by the request threads.
+
+    pika connections are not thread-safe, so publishes are serialised. An
+    idle connection may have been dropped by the broker (missed heartbeats);
+    it is re-opened and the publish retried once.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.connection = None
+        self.channel = None
+        self._lock = threading.Lock()
+
+    def connect(self):
+        credentials = pika.PlainCredentials(
+            os.getenv("RABBITMQ_DEFAULT_USER"), os.getenv("RABBITMQ_DEFAULT_PASS")
+        )
+        self.connection = pika.BlockingConnection(
+            pika.ConnectionParameters(
+                self.host,
+                port=int(os.getenv("RABBITMQ_PORT", "5672")),
+                credentials=credentials,
+            )
+        )
+        self.channel = self.connection.channel()
+        self.channel.exchange_declare(exchange=EXCHANGE, exchange_type="direct")
+        self.channel.queue_declare(queue=CONFIG_QUEUE)
+        self.channel.queue_bind(
+            queue=CONFIG_QUEUE, exchange=EXCHANGE, routing_key=CONFIG_ROUTING_KEY
+        )
+        self.channel.confirm_delivery()
+
+    def close(self):
+        if self.connection is not None and self.connection.is_open:
+            try:
+                self.connection.close()
+            except pika.exceptions.AMQPError:
+                pass
+        self.connection = None
+        self.channel = None
+
+    def publish_config_job(self, job_id, ip):
+        """Queue a config job; raises pika.exceptions.AMQPError on failure."""
+        with self._lock:
+            self._publish(json.dumps({"job_id": job_id, "ip": ip}))
+
+    def publish_config_jobs(self, job_ips):
+        """Queue config jobs ({job_id: ip}) in order; return the ids not queued.
+
+        Stops at the first failure the reconnect does not cure, since the
+        remaining messages would fail the same way.
+        """
+        job_ids = list(job_ips)
+        with self._lock:
+            for index, job_id in enumerate(job_ids):
+                try:
+                    self._publish(json.dumps({"job_id": job_id, "ip": job_ips[job_id]}))
+                except pika.exceptions.AMQPError as e:
+                    print(f"Could not queue config job {job_id}: {e!r}")
+                    return job_ids[index:]
+        return []
+
+    def _publish(self, body):
+        for attempt in range(2):
+            try:
+                if self.channel is None or self.channel.is_closed:
+                    self.close()
+                    self.connect()
+                self.channel.basic_publish(
+                    exchange=EXCHANGE,
+                    routing_key=CONFIG_ROUTING_KEY,
+                    body=body,
+                    mandatory=True,
+                )
+                return
+            except (pika.exceptions.UnroutableError, pika.exceptions.NackError):
+                raise
+            except pika.exceptions.AMQPError:
+                self.close()
+                if attempt:
+                    raise
+
+
+_publisher = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher():
+    global _publisher
+    if _publisher is None:
+        with _publisher_lock:
+            if _publisher is None:
+                _publisher = JobPublisher(os.getenv("RABBITMQ_HOST", "rabbitmq"))
+    return _publisher
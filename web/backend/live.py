@@ -0,0 +1,172 @@
+"""Live device updates for the device page's Server-Sent Events stream.
+
+One listener thread per web process follows device_state and fans changes
+out to the subscribed pages, so open dashboards cost no queries of their
+own. The listener uses a MongoDB change stream; on a server without one (a
+standalone mongod) it falls back to a single shared query per
+LIVE_POLL_INTERVAL over the subscribed devices' device_state.updated_at.
+"""
+
+import os
+import queue
+import threading
+import time
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+import db
+
+# Error code of a change stream opened on a standalone server
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+LIVE_POLL_INTERVAL = float(os.getenv("LIVE_POLL_INTERVAL", "5"))
+# Events a slow client may fall behind by before newer ones are dropped
+LIVE_QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "100"))
+
+# device_state fields whose change is pushed, and the event they produce
+WATCHED_FIELDS = {
+    "interfaces_time": "interfaces",
+    "version_time": "version",
+    "config_hash": "config",
+}
+
+_events = None
+_events_lock = threading.Lock()
+
+
+def _snapshot(state):
+    return {field: state.get(field) for field in ("updated_at", *WATCHED_FIELDS)}
+
+
+def _events_for(state, previous):
+    """(event, payload) pairs for what changed in 'state' since 'previous'."""
+    ip = state["ip_address"]
+    events = []
+    for field, event in WATCHED_FIELDS.items():
+        if state.get(field) is None or state.get(field) == previous.get(field):
+            continue
+        if event == "interfaces":
+            payload = db.get_latest_interface_status(ip, state)
+        elif event == "version":
+            payload = db.get_latest_device_details(ip, state)
+        else:
+            payload = {
+                "config_hash": state["config_hash"],
+                "config_time": state.get("config_time"),
+            }
+        events.append((event, payload))
+    return events
+
+
+class DeviceEvents:
+    """Fan device_state changes out to per-client queues, keyed by device IP."""
+
+    def __init__(self, poll_interval=5, queue_size=100):
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        # ip -> set of subscriber queues
+        self._subscribers = {}
+        # ip -> watched fields as last seen, so each change is sent once
+        self._seen = {}
+        self._resume_token = None
+        self._lock = threading.Lock()
+        threading.Thread(target=self._run, name="live-events", daemon=True).start()
+
+    def subscribe(self, ip):
+        """Register a client for 'ip'; returns the queue its events go to."""
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            first = ip not in self._subscribers
+            self._subscribers.setdefault(ip, set()).add(subscriber)
+        if first:
+            # Baseline: only changes after the page was rendered are sent
+            snapshot = _snapshot(db.get_device_state(ip))
+            with self._lock:
+                self._seen.setdefault(ip, snapshot)
+        return subscriber
+
+    def unsubscribe(self, ip, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(ip, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self._subscribers.pop(ip, None)
+                self._seen.pop(ip, None)
+
+    def publish(self, state):
+        """Queue the events of a changed device_state document."""
+        ip = state.get("ip_address")
+        with self._lock:
+            subscribers = list(self._subscribers.get(ip, ()))
+            if not subscribers:
+                return
+            previous = self._seen.get(ip, {})
+            self._seen[ip] = _snapshot(state)
+        for event in _events_for(state, previous):
+            for subscriber in subscribers:
+                try:
+                    subscriber.put_nowait(event)
+                except queue.Full:
+                    print(f"Live events for {ip}: client too slow, event dropped")
+
+    def _run(self):
+        while True:
+            try:
+                self._watch()
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    print(f"No change streams, polling every {self.poll_interval}s")
+                    break
+                # e.g. the resume point fell off the oplog: start afresh
+                print(f"Live events change stream failed ({e}), restarting...")
+                self._resume_token = None
+                time.sleep(self.poll_interval)
+            except PyMongoError as e:
+                print(f"Live events change stream failed ({e!r}), reopening...")
+                time.sleep(self.poll_interval)
+        while True:
+            try:
+                self._poll()
+            except PyMongoError as e:
+                print(f"Live events poll failed: {e!r}")
+            time.sleep(self.poll_interval)
+
+    def _watch(self):
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update"]}}}]
+        with db.get_db()["device_state"].watch(
+            pipeline, full_document="updateLookup", resume_after=self._resume_token
+        ) as stream:
+            for change in stream:
+                self._resume_token = stream.resume_token
+                if change.get("fullDocument"):
+                    self.publish(change["fullDocument"])
+
+    def _poll(self):
+        """One query for every subscribed device changed since last seen."""
+        with self._lock:
+            ips = list(self._subscribers)
+            since = [
+                self._seen[ip]["updated_at"]
+                for ip in ips
+                if self._seen.get(ip, {}).get("updated_at")
+            ]
+        if not ips:
+            return
+        query = {"ip_address": {"$in": ips}}
+        if len(since) == len(ips):
+            query["updated_at"] = {"$gt": min(since)}
+        for state in db.get_db()["device_state"].find(query):
+            if state.get("updated_at") != self._seen.get(state["ip_address"], {}).get(
+                "updated_at"
+            ):
+                self.publish(state)
+
+
+def get_device_events():
+    """The process-wide DeviceEvents, started on first use."""
+    global _events
+    if _events is None:
+        with _events_lock:
+            if _events is None:
+                _events = DeviceEvents(LIVE_POLL_INTERVAL, LIVE_QUEUE_SIZE)
+    return _events
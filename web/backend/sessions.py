@@ -0,0 +1,191 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from netmiko import ConnectHandler
+
+# Interactive actions (ping, ...) share warm SSH sessions. At most
+# WEB_SESSIONS_PER_DEVICE run on a device at once; further clicks wait up to
+# WEB_SESSION_WAIT_TIMEOUT seconds for a session to come back.
+SESSIONS_PER_DEVICE = int(os.getenv("WEB_SESSIONS_PER_DEVICE", "1"))
+SESSION_POOL_SIZE = int(os.getenv("WEB_SESSION_POOL_SIZE", "20"))
+SESSION_IDLE_TIMEOUT = float(os.getenv("WEB_SESSION_IDLE_TIMEOUT", "120"))
+SESSION_KEEPALIVE = float(os.getenv("WEB_SESSION_KEEPALIVE", "30"))
+SESSION_WAIT_TIMEOUT = float(os.getenv("WEB_SESSION_WAIT_TIMEOUT", "30"))
+
+_sessions = None
+_sessions_lock = threading.Lock()
+
+
+class DeviceBusy(Exception):
+    """No session to the device became free within the wait timeout."""
+
+
+class DeviceSessions:
+    """Warm netmiko sessions for interactive web actions, bounded per device.
+
+    Each device gets at most 'per_device' sessions in use at a time, so
+    concurrent clicks queue up instead of opening parallel sessions that
+    exhaust the device's VTY lines; with one, actions on a device run one
+    after the other over the same session. Idle sessions are health-checked
+    on checkout, probed every 'keepalive' seconds and closed once unused for
+    'idle_timeout' seconds, or when more than 'max_idle' are kept in total.
+    """
+
+    def __init__(
+        self,
+        per_device=1,
+        max_idle=20,
+        idle_timeout=120,
+        keepalive=30,
+        wait_timeout=30,
+    ):
+        self.per_device = per_device
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.wait_timeout = wait_timeout
+        # ip -> semaphore bounding the sessions in use on the device
+        self._slots = {}
+        # id(conn) -> (ip, conn, credentials, last_used), least recent first
+        self._idle = OrderedDict()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        threading.Thread(
+            target=self._maintain, name="web-sessions", daemon=True
+        ).start()
+
+    @contextmanager
+    def session(self, ip, username, password, device_type="cisco_ios"):
+        """Check out a live session to 'ip' for the duration of the block.
+
+        Raises DeviceBusy if the device's sessions stay in use for longer
+        than 'wait_timeout'. A session that raised is closed rather than
+        returned, since its channel state is unknown.
+        """
+        with self._lock:
+            slot = self._slots.setdefault(
+                ip, threading.BoundedSemaphore(self.per_device)
+            )
+        if not slot.acquire(timeout=self.wait_timeout):
+            raise DeviceBusy(f"{ip} is busy, try again shortly")
+        try:
+            credentials = (username, password, device_type)
+            conn = self._checkout(ip, credentials)
+            try:
+                yield conn
+            except Exception:
+                self._close(conn)
+                raise
+            self._checkin(ip, conn, credentials)
+        finally:
+            slot.release()
+
+    def _checkout(self, ip, credentials):
+        """Newest healthy idle session to 'ip', or a new one."""
+        while True:
+            with self._lock:
+                key = next(
+                    (k for k in reversed(self._idle) if self._idle[k][0] == ip), None
+                )
+                entry = self._idle.pop(key) if key is not None else None
+            if entry is None:
+                break
+            _, conn, idle_credentials, _ = entry
+            if idle_credentials == credentials and self._is_alive(conn):
+                return conn
+            self._close(conn)
+        username, password, device_type = credentials
+        return ConnectHandler(
+            device_type=device_type,
+            host=ip,
+            username=username,
+            password=password,
+            keepalive=self.keepalive,
+        )
+
+    def _checkin(self, ip, conn, credentials):
+        stale = []
+        with self._lock:
+            self._idle[id(conn)] = (ip, conn, credentials, time.monotonic())
+            stale += self._trim(ip)
+        for old in stale:
+            self._close(old)
+
+    def _trim(self, ip):
+        """Drop the oldest idle sessions over the per-device and total limits.
+
+        Called with the lock held; returns the sessions to close.
+        """
+        stale = []
+        same_device = [k for k, entry in self._idle.items() if entry[0] == ip]
+        for key in same_device[: max(0, len(same_device) - self.per_device)]:
+            stale.append(self._idle.pop(key)[1])
+        while len(self._idle) > self.max_idle:
+            stale.append(self._idle.popitem(last=False)[1][1])
+        return stale
+
+    def close_all(self):
+        self._stopped.set()
+        with self._lock:
+            entries = list(self._idle.values())
+            self._idle.clear()
+        for _, conn, _, _ in entries:
+            self._close(conn)
+
+    def _maintain(self):
+        while not self._stopped.wait(self.keepalive):
+            now = time.monotonic()
+            with self._lock:
+                # Checked-out sessions are never in _idle, so nobody else is
+                # using the ones taken out here
+                entries = list(self._idle.items())
+                self._idle.clear()
+            alive = []
+            for key, entry in entries:
+                if now - entry[3] <= self.idle_timeout and self._is_alive(entry[1]):
+                    alive.append((key, entry))
+                else:
+                    self._close(entry[1])
+            stale = []
+            with self._lock:
+                # Sessions released while probing are newer; keep them last
+                for key, entry in reversed(alive):
+                    self._idle[key] = entry
+                    self._idle.move_to_end(key, last=False)
+                for ip in {entry[0] for _, entry in alive}:
+                    stale += self._trim(ip)
+            for conn in stale:
+                self._close(conn)
+
+    @staticmethod
+    def _is_alive(conn):
+        try:
+            return conn.is_alive()
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.disconnect()
+        except Exception:
+            pass
+
+
+def get_sessions():
+    """The process-wide DeviceSessions, created on first use."""
+    global _sessions
+    if _sessions is None:
+        with _sessions_lock:
+            if _sessions is None:
+                _sessions = DeviceSessions(
+                    per_device=SESSIONS_PER_DEVICE,
+                    max_idle=SESSION_POOL_SIZE,
+                    idle_timeout=SESSION_IDLE_TIMEOUT,
+                    keepalive=SESSION_KEEPALIVE,
+                    wait_timeout=SESSION_WAIT_TIMEOUT,
+                )
+    return _sessions
@@ -0,0 +1,10 @@
+import os
+import sys
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The service's modules import each other by their flat names (as in the
+# Docker image), and the other services have modules of the same names
+for name in ("codec", "sessions"):
+    sys.modules.pop(name, None)
+sys.path.insert(0, SERVICE_DIR)
@@ -0,0 +1,61 @@
+import pytest
+
+import app as web_app
+
+
+@pytest.fixture
+def client(monkeypatch):
+    selected = []
+    monkeypatch.setattr(
+        web_app.db, "select_device_ips", lambda **kw: selected.append(kw) or []
+    )
+    client = web_app.app.test_client()
+    client.selected = selected
+    return client
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        {"ips": "10.0.0.1", "commands": ["interface Gi1", "shutdown"]},
+        {"ips": [], "commands": ["interface Gi1"]},
+        {"ips": ["10.0.0.1", 7], "commands": ["interface Gi1"]},
+    ],
+)
+def test_malformed_ips_are_rejected(client, body):
+    response = client.post("/bulk/config", json=body)
+    assert response.status_code == 400
+    assert "'ips'" in response.get_json()["message"]
+    assert client.selected == []
+
+
+@pytest.mark.parametrize(
+    "commands",
+    ["interface Gi1\nshutdown", ["interface Gi1", 5], [{"line": "x"}], [], [" "]],
+)
+def test_malformed_commands_are_rejected(client, commands):
+    response = client.post(
+        "/bulk/config", json={"ips": ["10.0.0.1"], "commands": commands}
+    )
+    assert response.status_code == 400
+    assert client.selected == []
+
+
+@pytest.mark.parametrize(
+    "body", [{"type": 1, "commands": ["x"]}, {"q": ["R"], "commands": ["x"]}, []]
+)
+def test_malformed_selectors_are_rejected(client, body):
+    assert client.post("/bulk/config", json=body).status_code == 400
+    assert client.selected == []
+
+
+def test_well_formed_body_reaches_the_selector(client):
+    response = client.post(
+        "/bulk/config",
+        json={"ips": ["10.0.0.1"], "type": "switch", "commands": ["interface Gi1", ""]},
+    )
+    # No such device in the stubbed inventory
+    assert response.status_code == 404
+    assert client.selected == [
+        {"ips": ["10.0.0.1"], "device_type": "switch", "hostname": None}
+    ]
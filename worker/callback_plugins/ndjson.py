@@ -0,0 +1,47 @@
+# Streams one compact JSON record per host and task result, so the worker
+# can act on each host as soon as its commands have run.
+import json
+import sys
+
+from ansible.plugins.callback import CallbackBase
+
+DOCUMENTATION = """
+    name: ndjson
+    type: stdout
+    short_description: one JSON line per command result
+    description:
+      - Writes a single-line JSON record to stdout for every task result that
+        carries command output, and for every failed or unreachable host.
+      - Everything else (play banners, debug tasks, stats) is left out.
+    requirements:
+      - set as stdout callback in configuration
+"""
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = "stdout"
+    CALLBACK_NAME = "ndjson"
+
+    def _emit(self, result, status, **fields):
+        record = {
+            "event": "result",
+            "host": result._host.get_name(),
+            "task": result._task.get_name(),
+            "status": status,
+        }
+        record.update(fields)
+        sys.stdout.write(json.dumps(record, separators=(",", ":")) + "\n")
+        sys.stdout.flush()
+
+    def v2_runner_on_ok(self, result):
+        stdout = result._result.get("stdout")
+        if stdout is not None:
+            self._emit(result, "ok", stdout=stdout)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        if not ignore_errors:
+            self._emit(result, "failed", msg=str(result._result.get("msg", "")))
+
+    def v2_runner_on_unreachable(self, result):
+        self._emit(result, "unreachable", msg=str(result._result.get("msg", "")))
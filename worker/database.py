@@ -1,10 +1,404 @@
-from pymongo import MongoClient
+import datetime
+import hashlib
+import threading
+from pymongo import (
+    ASCENDING,
+    DESCENDING,
+    DeleteMany,
+    IndexModel,
+    MongoClient,
+    ReturnDocument,
+    UpdateOne,
+)
 import os
+import codec
+
+# Results from concurrent jobs are micro-batched into one insert_many every
+# this many seconds; 0 writes each job's results as soon as it finishes
+WRITE_FLUSH_INTERVAL = float(os.getenv("WORKER_WRITE_FLUSH_INTERVAL", "0"))
+
+
+def parse_retention(spec):
+    """Parse "show ip interface brief=7,show version=30" into {command: days}."""
+    days = {}
+    for item in (spec or "").split(","):
+        if "=" in item:
+            command, value = item.rsplit("=", 1)
+            days[command.strip()] = float(value)
+    return days
+
+
+# Days each command's raw history is kept, matched on the full command or its
+# first word (e.g. "ping"); unlisted commands, such as the running-config
+# history that references config versions, are kept forever
+RETENTION_DAYS = parse_retention(
+    os.getenv("RETENTION_DAYS", "show ip interface brief=7,show version=30")
+)
+
+# Serves the "latest successful output of a command for a device" lookups
+OUTPUT_INDEXES = [
+    IndexModel(
+        [
+            ("ip_address", ASCENDING),
+            ("command", ASCENDING),
+            ("success", ASCENDING),
+            ("time", DESCENDING),
+        ],
+        name="latest_output",
+    ),
+    # Documents are removed once their retention-derived expire_at passes
+    IndexModel([("expire_at", ASCENDING)], expireAfterSeconds=0, name="expire_at_ttl"),
+    # Time-range scans of one command, used by the interface rollup job
+    IndexModel(
+        [("command", ASCENDING), ("created_at", ASCENDING)], name="command_created"
+    ),
+]
+
+# One document per device, looked up by IP from the web UI
+STATE_INDEXES = [
+    IndexModel([("ip_address", ASCENDING)], unique=True, name="unique_ip_address"),
+]
+
+# One document per (device, interface) from the latest show ip interface
+# brief, for fleet-wide interface searches
+INTERFACE_INDEXES = [
+    IndexModel(
+        [("device_ip", ASCENDING), ("interface", ASCENDING)],
+        unique=True,
+        name="unique_device_interface",
+    ),
+    IndexModel([("status", ASCENDING), ("proto", ASCENDING)], name="status_proto"),
+    IndexModel([("proto", ASCENDING)], name="proto"),
+    IndexModel([("ip_address", ASCENDING)], name="ip_address"),
+]
+
+# Which device_state fields each command's latest successful output fills;
+# running configs are referenced by their config_blobs hash instead
+STATE_FIELDS = {
+    "show ip interface brief": "interfaces",
+    "show version": "version",
+}
+
+_client = None
+_client_lock = threading.Lock()
+_writer = None
+
+
+def get_db():
+    """Return the database from a process-wide pooled MongoClient."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(
+                    os.getenv("MONGODB_URI"),
+                    maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", "20")),
+                )
+    return _client[os.getenv("DB_NAME")]
+
+
+def ensure_indexes():
+    """Create the indexes the worker's collections rely on (idempotent)."""
+    get_db().outputs.create_indexes(OUTPUT_INDEXES)
+    get_db().device_state.create_indexes(STATE_INDEXES)
+    get_db().interfaces.create_indexes(INTERFACE_INDEXES)
 
 
 def set_device_info(device_info):
-    client = MongoClient(os.getenv("MONGODB_URI"))
-    db = client[os.getenv("DB_NAME")]
-    devices_collection = db.outputs
-    devices_collection.insert_one(device_info)
-    client.close()
+    get_db().outputs.insert_one(device_info)
+
+
+def set_device_infos(device_infos):
+    """Insert all results of a job at once.
+
+    Blocks until the documents are persisted, also when they go through the
+    micro-batching writer, so callers may ack the job afterwards.
+    """
+    if not device_infos:
+        return
+    if WRITE_FLUSH_INTERVAL > 0:
+        _get_writer().write(device_infos)
+    else:
+        _write_results(device_infos)
+
+
+def _state_updates(device_infos):
+    """Build the device_state upserts reflecting the newest results per device."""
+    now = datetime.datetime.utcnow()
+    changes = {}
+    for info in device_infos:
+        fields = changes.setdefault(info["ip_address"], {"updated_at": now})
+        fields["last_poll_time"] = info["time"]
+        if not info["success"]:
+            continue
+        if "config_hash" in info:
+            fields["config_hash"] = info["config_hash"]
+            fields["config_time"] = info["time"]
+        field = STATE_FIELDS.get(info["command"])
+        if field is not None:
+            fields[field] = info["output"]
+            fields[f"{field}_time"] = info["time"]
+    return [
+        UpdateOne({"ip_address": ip}, {"$set": fields}, upsert=True)
+        for ip, fields in changes.items()
+    ]
+
+
+def _hostname_updates(device_infos):
+    """Build the devices updates naming each device after its show version.
+
+    'hostname_lower' is what the web's device list filters and sorts on.
+    Only devices whose hostname changed are written.
+    """
+    hostnames = {}
+    for info in device_infos:
+        if (
+            info["command"] == "show version"
+            and info["success"]
+            and isinstance(info["output"], list)
+            and info["output"]
+            and info["output"][0].get("hostname")
+        ):
+            hostnames[info["ip_address"]] = info["output"][0]["hostname"]
+    return [
+        UpdateOne(
+            {
+                "ip": ip,
+                "$or": [
+                    {"hostname": {"$ne": hostname}},
+                    {"hostname_lower": {"$ne": hostname.lower()}},
+                ],
+            },
+            {"$set": {"hostname": hostname, "hostname_lower": hostname.lower()}},
+        )
+        for ip, hostname in hostnames.items()
+    ]
+
+
+def _interface_updates(device_infos):
+    """Build the interfaces upserts from the newest interface table per device.
+
+    Interfaces that disappeared from a device's table are removed.
+    """
+    tables = {}
+    for info in device_infos:
+        if (
+            info["command"] == "show ip interface brief"
+            and info["success"]
+            and isinstance(info["output"], list)
+        ):
+            tables[info["ip_address"]] = (info["output"], info["time"])
+    updates = []
+    for ip, (rows, polled_at) in tables.items():
+        names = []
+        for row in rows:
+            name = row.get("interface")
+            if not name:
+                continue
+            names.append(name)
+            updates.append(
+                UpdateOne(
+                    {"device_ip": ip, "interface": name},
+                    {
+                        "$set": {
+                            "ip_address": row.get("ip_address", ""),
+                            "status": row.get("status", ""),
+                            "proto": row.get("proto", ""),
+                            "polled_at": polled_at,
+                        }
+                    },
+                    upsert=True,
+                )
+            )
+        updates.append(DeleteMany({"device_ip": ip, "interface": {"$nin": names}}))
+    return updates
+
+
+def _store_config_blobs(db, device_infos):
+    """Move running-config texts into the content-addressed config_blobs.
+
+    Each history entry keeps only the SHA-256 of its config. Blobs are keyed
+    by that hash and only inserted when missing, so an unchanged config
+    costs no new storage however often it is polled.
+    """
+    blobs = {}
+    for info in device_infos:
+        if (
+            info["command"] == "show running-config"
+            and info["success"]
+            and isinstance(info["output"], str)
+        ):
+            text = info["output"]
+            config_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+            blobs[config_hash] = text
+            info["config_hash"] = config_hash
+            info["output"] = None
+    if not blobs:
+        return
+    now = datetime.datetime.utcnow()
+    db.config_blobs.bulk_write(
+        [
+            UpdateOne(
+                {"_id": config_hash},
+                {
+                    "$setOnInsert": {
+                        "text": codec.encode(text),
+                        "size": len(text),
+                        "created_at": now,
+                    }
+                },
+                upsert=True,
+            )
+            for config_hash, text in blobs.items()
+        ],
+        ordered=False,
+    )
+
+
+def expire_at(command, created_at):
+    """When a history entry of 'command' expires, or None to keep it forever."""
+    days = RETENTION_DAYS.get(command)
+    if days is None:
+        days = RETENTION_DAYS.get(command.split(" ", 1)[0])
+    if days is None:
+        return None
+    return created_at + datetime.timedelta(days=days)
+
+
+def _write_results(device_infos):
+    """Append results to the outputs history and refresh device_state (and
+    the devices' hostnames)."""
+    db = get_db()
+    now = datetime.datetime.utcnow()
+    for info in device_infos:
+        info["created_at"] = now
+        expires = expire_at(info["command"], now)
+        if expires is not None:
+            info["expire_at"] = expires
+    _store_config_blobs(db, device_infos)
+    state_updates = _state_updates(device_infos)
+    interface_updates = _interface_updates(device_infos)
+    hostname_updates = _hostname_updates(device_infos)
+    for info in device_infos:
+        # Large raw outputs and the verbose ansible error logs are compressed
+        info["output"] = codec.encode(info["output"])
+        info["error"] = codec.encode(info["error"])
+    db.outputs.insert_many(device_infos, ordered=False)
+    db.device_state.bulk_write(state_updates, ordered=False)
+    if interface_updates:
+        db.interfaces.bulk_write(interface_updates, ordered=False)
+    if hostname_updates:
+        db.devices.bulk_write(hostname_updates, ordered=False)
+
+
+def record_poll_result(ip, reachable):
+    """Track consecutive failed polls on the device, for scheduler backoff.
+
+    A successful poll only writes when it ends a failure streak, and
+    'updated_at' is bumped so the scheduler's inventory sees the change.
+    """
+    devices = get_db().devices
+    now = datetime.datetime.utcnow()
+    if reachable:
+        devices.update_one(
+            {"ip": ip, "consecutive_failures": {"$gt": 0}},
+            {"$set": {"consecutive_failures": 0, "updated_at": now}},
+        )
+    else:
+        devices.update_one(
+            {"ip": ip},
+            {"$inc": {"consecutive_failures": 1}, "$set": {"updated_at": now}},
+        )
+
+
+def get_device(ip):
+    """The device's inventory document (credentials and type), or None."""
+    return get_db().devices.find_one(
+        {"ip": ip}, {"username": 1, "password": 1, "device_type": 1}
+    )
+
+
+def claim_config_job(job_id):
+    """Mark a queued config job as running and return it.
+
+    Returns None if the job does not exist or already left the queued state,
+    e.g. a redelivered message whose push had started before a crash; such
+    a push is never repeated blindly.
+    """
+    now = datetime.datetime.utcnow()
+    return get_db().config_jobs.find_one_and_update(
+        {"_id": job_id, "status": "queued"},
+        {"$set": {"status": "running", "started_at": now, "updated_at": now}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def finish_config_job(job_id, success, message, interfaces=None):
+    now = datetime.datetime.utcnow()
+    get_db().config_jobs.update_one(
+        {"_id": job_id},
+        {
+            "$set": {
+                "status": "succeeded" if success else "failed",
+                "message": message,
+                "interfaces": interfaces,
+                "finished_at": now,
+                "updated_at": now,
+            }
+        },
+    )
+
+
+class BatchWriter:
+    """Collects results from concurrent jobs and flushes them together.
+
+    write() queues a job's documents and waits for the flush that persists
+    them, re-raising the error if that flush failed.
+    """
+
+    def __init__(self, flush_interval, max_batch=1000):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._pending = []
+        self._queued = 0
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, name="batch-writer", daemon=True).start()
+
+    def write(self, docs):
+        entry = {"docs": docs, "done": threading.Event(), "error": None}
+        with self._cond:
+            self._pending.append(entry)
+            self._queued += len(docs)
+            if self._queued >= self.max_batch:
+                self._cond.notify()
+        entry["done"].wait()
+        if entry["error"] is not None:
+            raise entry["error"]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._queued < self.max_batch:
+                    self._cond.wait(timeout=self.flush_interval)
+                batch, self._pending, self._queued = self._pending, [], 0
+            if not batch:
+                continue
+            error = None
+            try:
+                _write_results([doc for entry in batch for doc in entry["docs"]])
+            except Exception as e:
+                # Any failure (also e.g. DocumentTooLarge, InvalidDocument)
+                # goes to the waiting jobs; the writer itself keeps running
+                error = e
+            for entry in batch:
+                entry["error"] = error
+                entry["done"].set()
+
+
+def _get_writer():
+    global _writer
+    if _writer is None:
+        with _client_lock:
+            if _writer is None:
+                _writer = BatchWriter(WRITE_FLUSH_INTERVAL)
+    return _writer
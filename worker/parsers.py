@@ -0,0 +1,236 @@
+"""Parsers turning raw IOS command output into the documents stored in Mongo.
+
+Patterns are compiled once at import. Each parser walks the output a single
+time, and every pattern is guarded by a plain substring test so most lines
+never reach the regex engine.
+"""
+
+import os
+import re
+
+import structured
+
+# "builtin" uses the parsers below and TextFSM only for commands without one;
+# "textfsm" parses every command that has a template through TextFSM. Both
+# produce the schema of structured.py.
+PARSER_ENGINE = os.getenv("PARSER_ENGINE", "builtin")
+
+# show version: fields taken from the first line that matches. Each rule is
+# (field, marker, patterns); a line is only searched when it contains the
+# marker, and a rule is dropped as soon as its field is filled.
+HOSTNAME_RE = re.compile(r"^([\w-]+) uptime is (.+)")
+UPTIME_RE = re.compile(
+    r"(\d+) years, (\d+) weeks, (\d+) days, (\d+) hours, (\d+) minutes"
+)
+UPTIME_SIMPLE_RE = re.compile(r"(\d+) hours, (\d+) minutes")
+VERSION_RE = re.compile(r"Version ([\d.]+)\(([^)]+)\), RELEASE SOFTWARE.*")
+VERSION_ALT_RE = re.compile(r"Version ([\d.]+), RELEASE SOFTWARE \(([^)]+)\)")
+SOFTWARE_IMAGE_RE = re.compile(r'System image file is ".*?/([\w-]+)"')
+ROMMON_RE = re.compile(r"ROM: (.+)")
+RUNNING_IMAGE_RE = re.compile(r"Running image: (.+)")
+RELOAD_RE = re.compile(r"^Last reload reason: (.+)")
+CONFIG_REGISTER_RE = re.compile(r"Configuration register is (\S+)")
+
+VERSION_RULES = (
+    ("hostname", " uptime is ", (HOSTNAME_RE,)),
+    ("version", "RELEASE SOFTWARE", (VERSION_RE, VERSION_ALT_RE)),
+    ("software_image", 'System image file is "', (SOFTWARE_IMAGE_RE,)),
+    ("rommon", "ROM: ", (ROMMON_RE,)),
+    ("running_image", "Running image: ", (RUNNING_IMAGE_RE,)),
+    ("reload_reason", "Last reload reason: ", (RELOAD_RE,)),
+    ("config_register", "Configuration register is ", (CONFIG_REGISTER_RE,)),
+)
+
+# show version: values collected from every line, in order, without repeats
+HARDWARE_RE = re.compile(r"^cisco (\S+).+processor")
+SERIAL_RE = re.compile(r"Processor board ID ([\w\d]+)")
+MAC_RE = re.compile(r"(?:address is|MAC Address) ([\w.:-]+)", re.IGNORECASE)
+
+
+def _unique(values):
+    seen = set()
+    return [v for v in values if not (v in seen or seen.add(v))]
+
+
+def _find_macs(text):
+    """MAC_RE matches in order, scanning only the span that can contain them.
+
+    Neither the prefix nor the value can span a line break, so one scan of
+    the text finds exactly what a per-line scan would. A case-insensitive
+    alternation cannot use the regex engine's literal search, so the scan is
+    narrowed to the lines between the first and last "address" first.
+    """
+    if text.isascii():
+        lowered = text.lower()
+        first = lowered.find("address")
+        if first == -1:
+            return []
+        start = max(0, first - 4)
+        end = lowered.find("\n", lowered.rfind("address"))
+        text = text[start:end] if end != -1 else text[start:]
+    return MAC_RE.findall(text)
+
+
+def _fill_version_field(result, field, match):
+    if field == "hostname":
+        result["hostname"] = match.group(1)
+        result["uptime"] = uptime = match.group(2)
+        m = UPTIME_RE.search(uptime)
+        if m:
+            (
+                result["uptime_years"],
+                result["uptime_weeks"],
+                result["uptime_days"],
+                result["uptime_hours"],
+                result["uptime_minutes"],
+            ) = m.groups()
+        else:
+            m = UPTIME_SIMPLE_RE.search(uptime)
+            if m:
+                result["uptime_hours"], result["uptime_minutes"] = m.groups()
+    elif field == "version":
+        result["version"], result["release"] = match.groups()
+    else:
+        result[field] = match.group(1)
+
+
+def parse_show_version(text: str):
+    """Parse 'show version' output; returns a list with one dict."""
+    result = {
+        "software_image": "",
+        "version": "",
+        "release": "",
+        "rommon": "",
+        "hostname": "",
+        "uptime": "",
+        "uptime_years": "",
+        "uptime_weeks": "",
+        "uptime_days": "",
+        "uptime_hours": "",
+        "uptime_minutes": "",
+        "reload_reason": "",
+        "running_image": "",
+        "hardware": [],
+        "serial": [],
+        "config_register": "",
+        "mac_address": [],
+        "restarted": "",
+    }
+    pending = list(VERSION_RULES)
+    hardware = []
+    serial = []
+    for line in text.splitlines():
+        if pending:
+            filled = None
+            for rule in pending:
+                field, marker, patterns = rule
+                if marker not in line:
+                    continue
+                for pattern in patterns:
+                    m = pattern.search(line)
+                    if m:
+                        _fill_version_field(result, field, m)
+                        filled = filled or []
+                        filled.append(rule)
+                        break
+            if filled:
+                pending = [rule for rule in pending if rule not in filled]
+        if line.startswith("cisco "):
+            m = HARDWARE_RE.search(line)
+            if m:
+                hardware.append(m.group(1))
+        if "Processor board ID " in line:
+            m = SERIAL_RE.search(line)
+            if m:
+                serial.append(m.group(1))
+    result["hardware"] = _unique(hardware)
+    result["serial"] = _unique(serial)
+    result["mac_address"] = _unique(_find_macs(text))
+    return [result]
+
+
+def parse_show_ip_int_brief(text: str):
+    """Parse 'show ip interface brief' output into a list of dicts.
+
+    Each dict has keys: interface, ip_address, status, proto. Only the
+    table from the 'Interface' header up to the next device prompt is read,
+    which drops Ansible noise around it.
+    """
+    lines = text.splitlines()
+    start = fallback = None
+    for i, ln in enumerate(lines):
+        if ln.lstrip().startswith("Interface"):
+            start = i
+            break
+        if fallback is None and "Interface" in ln and "IP-Address" in ln:
+            fallback = i
+    if start is None:
+        start = fallback
+    if start is None:
+        # No header: treat the first non-blank line as one, read to the end
+        rows = [ln for ln in lines if ln.strip()][1:]
+    else:
+        # Rows run up to the next prompt-looking line (e.g. R1# or R1>)
+        rows = []
+        for ln in lines[start:]:
+            stripped = ln.strip()
+            if stripped.endswith(("#", ">")):
+                break
+            if stripped:
+                rows.append(ln)
+        rows = rows[1:]
+    result = []
+    seen_interfaces = set()
+    for row in rows:
+        parts = row.split()
+        # Keep the 'administratively down' status together
+        if "administratively" in parts:
+            idx = parts.index("administratively")
+            if idx + 1 < len(parts):
+                parts[idx] = "administratively down"
+                del parts[idx + 1]
+        if len(parts) < 4:
+            continue
+        name = parts[0]
+        if name in seen_interfaces or name.lower() == "interface":
+            continue
+        seen_interfaces.add(name)
+        result.append(
+            {
+                "interface": name,
+                "ip_address": parts[1],
+                "status": parts[-2],
+                "proto": parts[-1],
+            }
+        )
+    return result
+
+
+# Command -> parser; commands without one are stored as trimmed text
+PARSERS = {
+    "show ip interface brief": parse_show_ip_int_brief,
+    "show version": parse_show_version,
+}
+
+
+def get_parser(command):
+    """Return the parser registered for 'command', ignoring case, extra
+    whitespace and any output filter ('| include ...')."""
+    key = " ".join((command or "").lower().split())
+    parser = PARSERS.get(key)
+    if parser is None and "|" in key:
+        parser = PARSERS.get(key.split("|", 1)[0].strip())
+    return parser
+
+
+def normalize_output(command: str, text: str):
+    """Parse 'text' with the command's registered parser or its TextFSM
+    template, or trim it."""
+    parser = get_parser(command)
+    if parser is None or PARSER_ENGINE == "textfsm":
+        rows = structured.parse(command, text)
+        if rows is not None:
+            return rows
+    if parser is not None:
+        return parser(text)
+    return (text or "").strip()
@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from netmiko import ConnectHandler
+
+
+class SessionPool:
+    """Bounded pool of authenticated netmiko sessions keyed by device IP.
+
+    Sessions are checked out for the duration of a job and returned to the
+    pool afterwards, so the next polling cycle reuses the warm SSH session
+    instead of paying the handshake and login again. Idle sessions are probed
+    every 'keepalive' seconds (which also keeps the VTY line busy) and closed
+    once unused for 'idle_timeout' seconds or when the pool is full.
+    """
+
+    def __init__(self, max_sessions=50, idle_timeout=300, keepalive=30):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        # ip -> (connection, credentials, last_used), least recently used first
+        self._idle = OrderedDict()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._maintainer = threading.Thread(
+            target=self._maintain, name="session-pool", daemon=True
+        )
+        self._maintainer.start()
+
+    def acquire(self, ip, username, password, device_type="cisco_ios"):
+        """Check out a live session for 'ip', reusing an idle one if possible."""
+        credentials = (username, password, device_type)
+        with self._lock:
+            entry = self._idle.pop(ip, None)
+        if entry is not None:
+            conn, idle_credentials, _ = entry
+            if idle_credentials == credentials and self._is_alive(conn):
+                return conn
+            self._close(conn)
+        return ConnectHandler(
+            device_type=device_type,
+            host=ip,
+            username=username,
+            password=password,
+            keepalive=self.keepalive,
+        )
+
+    def release(self, ip, conn, username, password, device_type="cisco_ios"):
+        """Return a healthy session to the pool for later reuse."""
+        stale = []
+        with self._lock:
+            previous = self._idle.pop(ip, None)
+            if previous is not None:
+                # Two jobs for the same device ran at once; keep the newest
+                stale.append(previous[0])
+            self._idle[ip] = (
+                conn,
+                (username, password, device_type),
+                time.monotonic(),
+            )
+            while len(self._idle) > self.max_sessions:
+                stale.append(self._idle.popitem(last=False)[1][0])
+        for old in stale:
+            self._close(old)
+
+    @contextmanager
+    def session(self, ip, username, password, device_type="cisco_ios"):
+        """Context manager around acquire/release.
+
+        A session that raised is closed rather than returned, since its
+        channel state is unknown.
+        """
+        conn = self.acquire(ip, username, password, device_type)
+        try:
+            yield conn
+        except Exception:
+            self._close(conn)
+            raise
+        self.release(ip, conn, username, password, device_type)
+
+    def close_all(self):
+        self._stopped.set()
+        with self._lock:
+            entries = list(self._idle.values())
+            self._idle.clear()
+        for conn, _, _ in entries:
+            self._close(conn)
+
+    def _maintain(self):
+        while not self._stopped.wait(self.keepalive):
+            now = time.monotonic()
+            with self._lock:
+                expired = [
+                    ip
+                    for ip, (_, _, last_used) in self._idle.items()
+                    if now - last_used > self.idle_timeout
+                ]
+                closing = [self._idle.pop(ip)[0] for ip in expired]
+                # Probe the rest outside the lock; checked-out sessions are
+                # never in _idle, so nobody else is using these
+                probing = {ip: self._idle.pop(ip) for ip in list(self._idle)}
+            for conn in closing:
+                self._close(conn)
+            alive = {}
+            for ip, entry in probing.items():
+                if self._is_alive(entry[0]):
+                    alive[ip] = entry
+                else:
+                    self._close(entry[0])
+            stale = []
+            with self._lock:
+                # Re-insert in reverse so the original LRU order is kept
+                for ip, entry in reversed(list(alive.items())):
+                    if ip in self._idle:
+                        # Released again while we were probing; keep the newer
+                        stale.append(entry[0])
+                    else:
+                        self._idle[ip] = entry
+                        self._idle.move_to_end(ip, last=False)
+            for conn in stale:
+                self._close(conn)
+
+    @staticmethod
+    def _is_alive(conn):
+        try:
+            return conn.is_alive()
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.disconnect()
+        except Exception:
+            pass
@@ -0,0 +1,75 @@
+"""Structured parsing of command output with TextFSM (ntc-templates).
+
+Templates are resolved through the ntc-templates index once per command and
+compiled once per thread, instead of once per call as netmiko's
+use_textfsm=True does. Rows use one schema everywhere: the template's field
+names in lower case (interface, ip_address, status, proto, ...), with the
+names of older ntc-templates releases mapped onto them.
+"""
+
+import functools
+import os
+import threading
+
+try:
+    import textfsm
+    from ntc_templates.parse import _get_template_dir
+    from textfsm import clitable
+except ImportError:  # parse() then returns None and callers fall back
+    textfsm = None
+
+# Field names used by older ntc-templates releases -> current names
+KEY_ALIASES = {
+    "intf": "interface",
+    "ipaddr": "ip_address",
+}
+
+_local = threading.local()
+
+
+@functools.lru_cache(maxsize=None)
+def _index():
+    return clitable.CliTable("index", _get_template_dir())
+
+
+@functools.lru_cache(maxsize=None)
+def template_path(platform, command):
+    """Template file for 'command' on 'platform', or None if there is none."""
+    if textfsm is None:
+        return None
+    table = _index()
+    row = table.index.GetRowMatch({"Platform": platform, "Command": command})
+    if not row:
+        return None
+    # An index row may chain several templates; the first one holds the keys
+    template = table.index.index[row]["Template"].split(":")[0]
+    return os.path.join(_get_template_dir(), template)
+
+
+def _template(path):
+    """This thread's compiled template for 'path', reset for a new parse."""
+    templates = _local.__dict__.setdefault("templates", {})
+    fsm = templates.get(path)
+    if fsm is None:
+        with open(path) as f:
+            fsm = templates[path] = textfsm.TextFSM(f)
+    fsm.Reset()
+    return fsm
+
+
+def parse(command, text, platform="cisco_ios"):
+    """Parse 'text' into a list of dicts.
+
+    Returns None if 'command' has no template or the template rejected the
+    output (an Error state), so callers can fall back.
+    """
+    path = template_path(platform, " ".join((command or "").lower().split()))
+    if path is None:
+        return None
+    fsm = _template(path)
+    keys = [KEY_ALIASES.get(name.lower(), name.lower()) for name in fsm.header]
+    try:
+        rows = fsm.ParseText(text or "")
+    except textfsm.TextFSMError:
+        return None
+    return [dict(zip(keys, row)) for row in rows]
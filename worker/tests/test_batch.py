@@ -0,0 +1,21 @@
+from worker import merge_batch_jobs, select_commands
+
+
+def test_jobs_for_one_device_merge_their_commands():
+    jobs = [
+        ("10.0.0.1", "u", "p", ["show ip interface brief"]),
+        ("10.0.0.2", "u", "p", ["show version"]),
+        ("10.0.0.1", "u2", "p2", ["show version"]),
+    ]
+    assert merge_batch_jobs(jobs) == [
+        ("10.0.0.1", "u2", "p2", ["show ip interface brief", "show version"]),
+        ("10.0.0.2", "u", "p", ["show version"]),
+    ]
+
+
+def test_all_commands_win_the_merge():
+    for commands in ([None, ["show version"]], [["show version"], None]):
+        jobs = [("10.0.0.1", "u", "p", c) for c in commands]
+        (merged,) = merge_batch_jobs(jobs)
+        assert merged[3] is None
+        assert select_commands(merged[3]) == select_commands(None)
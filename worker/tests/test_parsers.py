@@ -0,0 +1,45 @@
+"""The parsers against outputs recorded from the implementation they replaced.
+
+Each case in parser_corpus/ holds a command, its raw output and what the
+previous parsers (parse_show_version_to_json and
+parse_show_ip_int_brief_to_json in worker.py) returned for it.
+"""
+
+import glob
+import json
+import os
+
+import pytest
+
+import parsers
+
+CORPUS = sorted(
+    glob.glob(os.path.join(os.path.dirname(__file__), "parser_corpus", "*", "*.json"))
+)
+
+
+def load_case(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def case_id(path):
+    return os.path.relpath(path, os.path.dirname(os.path.dirname(path)))
+
+
+def test_corpus_is_present():
+    assert CORPUS
+
+
+@pytest.mark.parametrize("path", CORPUS, ids=case_id)
+def test_parser_matches_recorded_output(path):
+    case = load_case(path)
+    parser = parsers.get_parser(case["command"])
+    assert parser(case["input"]) == case["expected"]
+
+
+@pytest.mark.parametrize("path", CORPUS, ids=case_id)
+def test_builtin_normalize_output_matches_recorded_output(path, monkeypatch):
+    monkeypatch.setattr(parsers, "PARSER_ENGINE", "builtin")
+    case = load_case(path)
+    assert parsers.normalize_output(case["command"], case["input"]) == case["expected"]
@@ -1,122 +1,81 @@
-import re
+import collections
+import math
 import pika
 import json
 import os
 import time
 import subprocess
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import database as db
+from parsers import normalize_output
+from sessions import SessionPool
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Commands collected from every device, paired with their playbook key
+COMMANDS = [
+    ("show ip interface brief", "show_ip_int_brief"),
+    ("show running-config", "show_running_config"),
+    ("show version", "show_version"),
+]
 
-def parse_show_version_to_json(text: str):
-    """
-    Parse the output of 'show version' into a structured dict as specified.
-    Returns a list with one dict (to match your requested format).
-    """
-    # Initialize fields
-    result = {
-        "software_image": "",
-        "version": "",
-        "release": "",
-        "rommon": "",
-        "hostname": "",
-        "uptime": "",
-        "uptime_years": "",
-        "uptime_weeks": "",
-        "uptime_days": "",
-        "uptime_hours": "",
-        "uptime_minutes": "",
-        "reload_reason": "",
-        "running_image": "",
-        "hardware": [],
-        "serial": [],
-        "config_register": "",
-        "mac_address": [],
-        "restarted": "",
-    }
-    lines = text.splitlines()
-    # Patterns for extraction
-    version_re = re.compile(r"Version ([\d.]+)\(([^)]+)\), RELEASE SOFTWARE.*")
-    version_alt_re = re.compile(r"Version ([\d.]+), RELEASE SOFTWARE \(([^)]+)\)")
-    hostname_re = re.compile(r"^([\w-]+) uptime is (.+)")
-    uptime_re = re.compile(
-        r"(\d+) years, (\d+) weeks, (\d+) days, (\d+) hours, (\d+) minutes"
-    )
-    uptime_simple_re = re.compile(r"(\d+) hours, (\d+) minutes")
-    hardware_re = re.compile(r"^cisco (\S+).+processor")
-    serial_re = re.compile(r"Processor board ID ([\w\d]+)")
-    config_reg_re = re.compile(r"Configuration register is (\S+)")
-    reload_re = re.compile(r"^Last reload reason: (.+)")
-    mac_re = re.compile(r"(?:address is|MAC Address) ([\w.:-]+)", re.IGNORECASE)
-    software_image_re = re.compile(r'System image file is ".*?/([\w-]+)"')
-    rommon_re = re.compile(r"ROM: (.+)")
-    running_image_re = re.compile(r"Running image: (.+)")
-    # Extraction loop
-    for line in lines:
-        if not result["hostname"]:
-            m = hostname_re.match(line)
-            if m:
-                result["hostname"] = m.group(1)
-                result["uptime"] = m.group(2)
-                # Try to extract uptime details
-                m2 = uptime_re.search(result["uptime"])
-                if m2:
-                    result["uptime_years"] = m2.group(1)
-                    result["uptime_weeks"] = m2.group(2)
-                    result["uptime_days"] = m2.group(3)
-                    result["uptime_hours"] = m2.group(4)
-                    result["uptime_minutes"] = m2.group(5)
-                else:
-                    m2 = uptime_simple_re.search(result["uptime"])
-                    if m2:
-                        result["uptime_hours"] = m2.group(1)
-                        result["uptime_minutes"] = m2.group(2)
-        if not result["version"]:
-            m = version_re.search(line)
-            if m:
-                result["version"] = m.group(1)
-                result["release"] = m.group(2)
-            else:
-                m = version_alt_re.search(line)
-                if m:
-                    result["version"] = m.group(1)
-                    result["release"] = m.group(2)
-        if not result["software_image"]:
-            m = software_image_re.search(line)
-            if m:
-                result["software_image"] = m.group(1)
-        if not result["rommon"]:
-            m = rommon_re.search(line)
-            if m:
-                result["rommon"] = m.group(1)
-        if not result["running_image"]:
-            m = running_image_re.search(line)
-            if m:
-                result["running_image"] = m.group(1)
-        if not result["reload_reason"]:
-            m = reload_re.search(line)
-            if m:
-                result["reload_reason"] = m.group(1)
-        if not result["config_register"]:
-            m = config_reg_re.search(line)
-            if m:
-                result["config_register"] = m.group(1)
-        m = hardware_re.search(line)
-        if m:
-            hw = m.group(1)
-            if hw not in result["hardware"]:
-                result["hardware"].append(hw)
-        m = serial_re.search(line)
-        if m:
-            sn = m.group(1)
-            if sn not in result["serial"]:
-                result["serial"].append(sn)
-        for mac in mac_re.findall(line):
-            if mac not in result["mac_address"]:
-                result["mac_address"].append(mac)
-    return [result]
+# "combined" runs every command in one playbook/SSH session per device,
+# "per_command" keeps the original one playbook run per command.
+COLLECT_MODE = os.getenv("ANSIBLE_COLLECT_MODE", "combined")
+
+# "stream" runs playbooks with the ndjson callback plugin and handles each
+# host's result as it arrives. Of the -vvv log only the last ANSIBLE_LOG_TAIL
+# lines per host (and of untagged output) are held, and only stored for hosts
+# that failed. "verbose" captures the whole -vvv JSON run.
+CAPTURE_MODE = os.getenv("ANSIBLE_CAPTURE_MODE", "stream")
+ANSIBLE_LOG_TAIL = int(os.getenv("ANSIBLE_LOG_TAIL", "200"))
+CALLBACK_PLUGINS = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "callback_plugins"
+)
+# Lines written by the ndjson callback start with this
+RECORD_PREFIX = '{"event":"result"'
+
+# Batch mode: gather up to WORKER_BATCH_SIZE jobs (waiting at most
+# WORKER_BATCH_WINDOW seconds for more to arrive) and poll them all with one
+# multi-host playbook run using ANSIBLE_FORKS parallel connections.
+BATCH_SIZE = int(os.getenv("WORKER_BATCH_SIZE", "1"))
+BATCH_WINDOW = float(os.getenv("WORKER_BATCH_WINDOW", "2"))
+ANSIBLE_FORKS = int(os.getenv("ANSIBLE_FORKS", "20"))
+
+# Number of jobs (or batches) run at once, and how many unacked messages the
+# broker may hand us; by default (0) just enough to keep every executor busy.
+CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "1"))
+PREFETCH = int(os.getenv("WORKER_PREFETCH", "0"))
+
+# "ansible" shells out to ansible-playbook, "netmiko" talks to the devices
+# directly over pooled SSH sessions that survive between polling cycles.
+COLLECTOR_ENGINE = os.getenv("COLLECTOR_ENGINE", "ansible")
+SESSION_POOL_SIZE = int(os.getenv("SESSION_POOL_SIZE", "50"))
+SESSION_IDLE_TIMEOUT = float(os.getenv("SESSION_IDLE_TIMEOUT", "300"))
+SESSION_KEEPALIVE = float(os.getenv("SESSION_KEEPALIVE", "30"))
+
+# Config pushes submitted from the web UI arrive on their own queue, each
+# message carrying the id of its config_jobs document and the device's IP.
+# They run on CONFIG_PUSH_CONCURRENCY threads over the session pool, one at a
+# time per device and at least CONFIG_PUSH_INTERVAL seconds apart. Pushes
+# waiting for their device hold a prefetched message but no thread, so up to
+# CONFIG_PREFETCH messages are taken off the queue at once.
+CONFIG_EXCHANGE = "jobs"
+CONFIG_QUEUE = os.getenv("RABBITMQ_CONFIG_QUEUE", "config_jobs")
+CONFIG_ROUTING_KEY = "config_push"
+CONFIG_PUSH_CONCURRENCY = int(os.getenv("CONFIG_PUSH_CONCURRENCY", "4"))
+CONFIG_PUSH_INTERVAL = float(os.getenv("CONFIG_PUSH_INTERVAL", "5"))
+CONFIG_PREFETCH = int(os.getenv("CONFIG_PREFETCH", "100"))
+
+_session_pool = None
+
+
+def effective_prefetch(batch_size):
+    """WORKER_PREFETCH, or by default enough messages for every executor."""
+    return PREFETCH or CONCURRENCY * max(1, batch_size)
 
 
 def iso_utc():
@@ -150,121 +109,16 @@ def _to_text_from_stdout_lines(val):
     return str(val)
 
 
-def crop_show_ip_int_brief(text: str) -> str:
-    """Return only the IOS table starting at the 'Interface' header.
-
-    This trims any Ansible noise and device prompts, keeping exactly the
-    section users expect to see from the CLI.
-    """
-    lines = [ln.rstrip() for ln in text.splitlines()]
-    # Find first header line that starts with 'Interface'
-    start_idx = None
-    for i, ln in enumerate(lines):
-        if ln.strip().startswith("Interface"):
-            start_idx = i
-            break
-    if start_idx is None:
-        # Try to find a line that contains the two first columns
-        for i, ln in enumerate(lines):
-            if "Interface" in ln and "IP-Address" in ln:
-                start_idx = i
-                break
-    if start_idx is None:
-        return text.strip()
-    kept = lines[start_idx:]
-    # Optionally stop at the next prompt-looking line (e.g., R1# or R1>)
-    stop_idx = None
-    for i, ln in enumerate(kept):
-        t = ln.strip()
-        if t.endswith("#") or t.endswith(">"):
-            stop_idx = i
-            break
-    if stop_idx is not None:
-        kept = kept[:stop_idx]
-    return "\n".join([ln.rstrip() for ln in kept]).strip()
-
-
-def parse_show_ip_int_brief_to_json(text: str):
-    """
-    Parse the output of 'show ip interface brief' into a list of dicts.
-    Each dict has keys: interface, ip_address, status, proto.
-    """
-    # First, crop to the table only
-    cropped = crop_show_ip_int_brief(text)
-    lines = [ln for ln in cropped.splitlines() if ln.strip()]
-    if not lines:
-        return []
-    # Find header line and column positions
-    header = lines[0]
-    columns = [col.strip().lower().replace("-", "_") for col in header.split()]
-    # Map header names to expected keys
-    col_map = {
-        "interface": "interface",
-        "ip_address": "ip_address",
-        "ip-address": "ip_address",
-        "status": "status",
-        "proto": "proto",
-        "protocol": "proto",
-    }
-    # Find the indices for each expected column
-    col_indices = []
-    for col in columns:
-        mapped = col_map.get(col, col)
-        col_indices.append(mapped)
-    # Parse each row
-    result = []
-    seen_interfaces = set()
-    for row in lines[1:]:
-        # Split by whitespace, but keep 'administratively down' together
-        parts = row.split()
-        # Heuristic: if 'administratively' is present, join with next part
-        if "administratively" in parts:
-            idx = parts.index("administratively")
-            if idx + 1 < len(parts):
-                parts[idx] = "administratively down"
-                del parts[idx + 1]
-        # Only keep rows with at least 4 columns
-        if len(parts) >= 4:
-            # Skip header row or any row where interface is 'Interface'
-            if parts[0].lower() == "interface":
-                continue
-            # Skip duplicates
-            if parts[0] in seen_interfaces:
-                continue
-            seen_interfaces.add(parts[0])
-            entry = {
-                "interface": parts[0],
-                "ip_address": parts[1],
-                "status": parts[-2],
-                "proto": parts[-1],
-            }
-            result.append(entry)
-    return result
-
-
-def normalize_output(command: str, text: str):
-    """Normalize raw/parsed command output per command type.
-    For 'show ip interface brief', return a list of dicts (JSON-serializable).
-    For 'show version', return a list with one dict as specified.
-    For others, return trimmed text.
-    """
-    c = (command or "").lower().strip()
-    if "show ip interface brief" in c:
-        return parse_show_ip_int_brief_to_json(text)
-    if "show version" in c:
-        return parse_show_version_to_json(text)
-    return (text or "").strip()
-
-
 def get_playbooks():
     return {
         "show_ip_int_brief": "show_ip_interface_brief.yml",
         "show_running_config": "show_running_config.yml",
         "show_version": "show_version.yml",
+        "show_all_commands": "show_all_commands.yml",
     }
 
 
-def run_ansible_playbook(playbook, inventory, extra_vars=None):
+def _ansible_command(playbook, inventory, extra_vars=None, forks=None):
     cmd = [
         "ansible-playbook",
         playbook,
@@ -273,28 +127,190 @@ def run_ansible_playbook(playbook, inventory, extra_vars=None):
         "-e",
         "ansible_python_interpreter=/usr/local/bin/python3",
     ]
+    if forks:
+        cmd.extend(["--forks", str(forks)])
     if extra_vars:
         for k, v in extra_vars.items():
-            cmd.extend(["-e", f"{k}={v}"])
+            if isinstance(v, (list, dict)):
+                # Structured values must be passed as JSON to keep their type
+                cmd.extend(["-e", json.dumps({k: v})])
+            else:
+                cmd.extend(["-e", f"{k}={v}"])
+    return cmd
+
+
+def _ansible_env():
+    env = os.environ.copy()
+    # Make ansible emit JSON so parsing is more reliable
+    env.setdefault("ANSIBLE_STDOUT_CALLBACK", "json")
+    # Reduce noisy deprecation warnings in output
+    env.setdefault("ANSIBLE_DEPRECATION_WARNINGS", "False")
+    # Disable host key checking for testing/dev environments (optional)
+    env.setdefault("ANSIBLE_HOST_KEY_CHECKING", "False")
+    return env
+
+
+def run_ansible_playbook(playbook, inventory, extra_vars=None, forks=None, timeout=120):
+    cmd = _ansible_command(playbook, inventory, extra_vars, forks)
     # Use higher verbosity to capture connection errors and details
     cmd.extend(["-vvv"])
     try:
-        env = os.environ.copy()
-        # Make ansible emit JSON so parsing is more reliable
-        env.setdefault("ANSIBLE_STDOUT_CALLBACK", "json")
-        # Reduce noisy deprecation warnings in output
-        env.setdefault("ANSIBLE_DEPRECATION_WARNINGS", "False")
-        # Disable host key checking for testing/dev environments (optional)
-        env.setdefault("ANSIBLE_HOST_KEY_CHECKING", "False")
-
         result = subprocess.run(
-            cmd, capture_output=True, text=True, timeout=120, env=env
+            cmd, capture_output=True, text=True, timeout=timeout, env=_ansible_env()
         )
         return result.returncode, result.stdout, result.stderr
     except Exception as e:
         return 1, "", str(e)
 
 
+def stream_ansible_playbook(
+    playbook, inventory, on_record, extra_vars=None, forks=None, timeout=120
+):
+    """Run a playbook with the ndjson callback, streaming its results.
+
+    on_record(record) is called from this thread for every result record as
+    soon as ansible writes it; a failed host's record carries the tail of its
+    -vvv log as 'log'. Returns (rc, log, host_logs): 'log' is the tail of the
+    output not tagged with a host (warnings, tracebacks) and 'host_logs' maps
+    each host that produced no record to the tail of its -vvv log.
+    """
+    env = _ansible_env()
+    env["ANSIBLE_STDOUT_CALLBACK"] = "ndjson"
+    env["ANSIBLE_CALLBACK_PLUGINS"] = CALLBACK_PLUGINS
+    log = collections.deque(maxlen=ANSIBLE_LOG_TAIL)
+    # host -> tail of its "<host> ..." verbose lines since its last record
+    host_logs = {}
+    reported = set()
+    cmd = _ansible_command(playbook, inventory, extra_vars, forks)
+    cmd.append("-vvv")
+    try:
+        proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            env=env,
+        )
+    except OSError as e:
+        return 1, str(e), {}
+    expired = threading.Event()
+    timer = threading.Timer(timeout, lambda: (expired.set(), proc.kill()))
+    timer.start()
+    try:
+        for line in proc.stdout:
+            if line.startswith(RECORD_PREFIX):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    log.append(line)
+                    continue
+                host = record.get("host")
+                reported.add(host)
+                host_log = host_logs.pop(host, ())
+                if record.get("status") != "ok":
+                    record["log"] = "".join(host_log).strip()
+                on_record(record)
+            elif line.startswith("<") and "> " in line:
+                host = line[1:].split("> ", 1)[0]
+                host_logs.setdefault(
+                    host, collections.deque(maxlen=ANSIBLE_LOG_TAIL)
+                ).append(line)
+            else:
+                log.append(line)
+        rc = proc.wait()
+    finally:
+        timer.cancel()
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+    if expired.is_set():
+        log.append(f"ansible-playbook killed after {timeout}s")
+    return (
+        rc,
+        "".join(log).strip(),
+        {
+            host: "".join(lines).strip()
+            for host, lines in host_logs.items()
+            if host not in reported
+        },
+    )
+
+
+def record_outputs(record):
+    """(outputs, error) of an ndjson record: the host's command outputs in
+    the order ios_command ran them, or the reason it has none followed by
+    the host's verbose log."""
+    if record.get("status") == "ok" and isinstance(record.get("stdout"), list):
+        return [_to_text_from_stdout(out) for out in record["stdout"]], None
+    error = record.get("msg") or f"host {record.get('status')}"
+    return None, "\n".join(part for part in (error, record.get("log")) if part)
+
+
+def unreported_log(log, host_logs, host):
+    """Error text for a host that produced no record: its verbose log, then
+    the run's untagged output."""
+    return "\n".join(part for part in (host_logs.get(host), log) if part)
+
+
+def _load_ansible_json(ansible_stdout):
+    """Return the JSON callback document from ansible stdout, or None."""
+    s = (ansible_stdout or "").strip()
+    first_brace = s.find("{")
+    if first_brace == -1:
+        return None
+    try:
+        return json.loads(s[first_brace:])
+    except ValueError:
+        return None
+
+
+def parse_ansible_host_results(ansible_stdout):
+    """Map the result of a (possibly multi-host) combined run back to each host.
+
+    Returns (outputs, errors): outputs maps host -> list of command outputs,
+    in the order of the 'commands' given to ios_command, for hosts whose
+    commands ran; errors maps host -> error text for hosts that failed or
+    were unreachable.
+    """
+    outputs = {}
+    errors = {}
+    parsed = _load_ansible_json(ansible_stdout)
+    if not isinstance(parsed, dict):
+        return outputs, errors
+    for play in parsed.get("plays", []):
+        for task in play.get("tasks", []):
+            for host, result in task.get("hosts", {}).items():
+                if not isinstance(result, dict) or host in errors:
+                    continue
+                if result.get("failed") or result.get("unreachable"):
+                    errors[host] = str(result.get("msg") or result)
+                    continue
+                stdout = result.get("stdout")
+                if isinstance(stdout, list):
+                    outputs[host] = [_to_text_from_stdout(out) for out in stdout]
+    return outputs, errors
+
+
+def split_command_outputs(outputs, commands):
+    """Pair ios_command's stdout list with the commands that produced it.
+
+    Returns an empty dict when the two do not line up.
+    """
+    if outputs is None or len(outputs) != len(commands):
+        return {}
+    return dict(zip(commands, outputs))
+
+
+def parse_ansible_command_outputs(ansible_stdout, commands):
+    """Split the result of a single-host combined run into one text per command.
+
+    Returns an empty dict when the output cannot be split.
+    """
+    outputs, _ = parse_ansible_host_results(ansible_stdout)
+    return split_command_outputs(next(iter(outputs.values()), None), commands)
+
+
 def parse_ansible_output(ansible_stdout):
     try:
         # Try to parse JSON callback output first
@@ -359,99 +375,639 @@ def parse_ansible_output(ansible_stdout):
         return ansible_stdout
 
 
-def save_command_output(ip, command, output, success=True, error=None):
-    db.set_device_info(
-        {
-            "ip_address": ip,
-            "command": command,
-            "time": iso_utc(),
-            "output": output,
-            "success": success,
-            "error": error,
-        }
+def save_command_output(ip, command, output, success=True, error=None, results=None):
+    """Store one command result, or append it to 'results' for a bulk write."""
+    document = {
+        "ip_address": ip,
+        "command": command,
+        "time": iso_utc(),
+        "output": output,
+        "success": success,
+        "error": error,
+    }
+    if results is not None:
+        results.append(document)
+    else:
+        db.set_device_info(document)
+
+
+def select_commands(requested=None):
+    """Return the COMMANDS entries a job asked for (all of them by default)."""
+    if not requested:
+        return list(COMMANDS)
+    return [entry for entry in COMMANDS if entry[0] in requested]
+
+
+def write_inventory(ip, username, password):
+    """Write a short-lived inventory for a single device under group [routers]."""
+    inventory_path = f"/tmp/inventory_{ip.replace('.', '_')}"
+    inventory_content = (
+        "[routers]\n"
+        f"{ip} ansible_host={ip} ansible_user={username} ansible_password={password} "
+        "ansible_network_os=cisco.ios.ios ansible_connection=network_cli\n"
     )
+    with open(inventory_path, "w") as f:
+        f.write(inventory_content)
+    return inventory_path
 
 
-def process_job(ip, username, password, device_type="cisco_ios"):
-    """
-    Minimal job runner for a single network device.
-    - Creates a temporary inventory with the provided credentials under group [routers]
-    - Runs the 'show ip interface brief' playbook
-    - Parses output and stores it in MongoDB via save_command_output
+def collect_per_command(ip, inventory_path, commands, results):
+    """Run one playbook per command, each in its own ansible-playbook process.
 
-    This is a basic implementation to unblock runtime errors. You can extend it
-    to select different playbooks or store results into specific collections.
+    Returns True if the device answered at least one command.
     """
-    try:
-        # Build a short-lived inventory for this device under group [routers]
-        inventory_path = f"/tmp/inventory_{ip.replace('.', '_')}"
-        inventory_content = (
-            "[routers]\n"
-            f"{ip} ansible_host={ip} ansible_user={username} ansible_password={password} "
-            "ansible_network_os=cisco.ios.ios ansible_connection=network_cli\n"
-        )
-        with open(inventory_path, "w") as f:
-            f.write(inventory_content)
-
-        # Execute a sequence of network show commands via their playbooks
-        playbooks = get_playbooks()
-        commands = [
-            ("show ip interface brief", "show_ip_int_brief"),
-            ("show running-config", "show_running_config"),
-            ("show version", "show_version"),
-        ]
-
-        for command_text, key in commands:
-            playbook_file = playbooks.get(key)
-            if not playbook_file:
+    playbooks = get_playbooks()
+    reachable = False
+    for command_text, key in commands:
+        playbook_file = playbooks.get(key)
+        if not playbook_file:
+            save_command_output(
+                ip,
+                command_text,
+                "",
+                success=False,
+                error=f"Playbook key '{key}' not found",
+                results=results,
+            )
+            continue
+
+        if CAPTURE_MODE == "stream":
+            records = []
+            _, log, host_logs = stream_ansible_playbook(
+                playbook_file, inventory_path, records.append
+            )
+            if records:
+                outputs, error = record_outputs(records[0])
+            else:
+                outputs, error = None, unreported_log(log, host_logs, ip)
+            if outputs:
+                normalized = normalize_output(command_text, outputs[0])
+                save_command_output(
+                    ip, command_text, normalized, success=True, results=results
+                )
+                reachable = True
+            else:
                 save_command_output(
                     ip,
                     command_text,
                     "",
                     success=False,
-                    error=f"Playbook key '{key}' not found",
+                    error=error or "ansible-playbook produced no result",
+                    results=results,
                 )
-                continue
+            continue
+
+        rc, stdout, stderr = run_ansible_playbook(playbook_file, inventory_path)
+        if rc == 0:
+            parsed = parse_ansible_output(stdout)
+            # If parsing produced nothing, prefer the raw stdout or stderr
+            if not parsed or parsed.strip() == "":
+                parsed = (stdout or "").strip() or (stderr or "").strip() or ""
+
+            normalized = normalize_output(command_text, parsed)
+            save_command_output(
+                ip, command_text, normalized, success=True, results=results
+            )
+            reachable = True
+        else:
+            err_text = (
+                stderr or stdout or "ansible-playbook returned non-zero exit code"
+            )
+            save_command_output(
+                ip, command_text, "", success=False, error=err_text, results=results
+            )
+    return reachable
+
+
+def save_split_outputs(ip, commands, outputs, error, results):
+    """Store one record per command from a combined run's split outputs.
+
+    Commands missing from 'outputs' are stored as failures with 'error'.
+    Returns True if any command produced output.
+    """
+    for command_text in commands:
+        text = outputs.get(command_text)
+        if text is None:
+            save_command_output(
+                ip, command_text, "", success=False, error=error, results=results
+            )
+            continue
+        normalized = normalize_output(command_text, text)
+        save_command_output(ip, command_text, normalized, success=True, results=results)
+    return bool(outputs)
+
+
+def collect_combined(ip, inventory_path, commands, results):
+    """Run every command in a single playbook, sharing one SSH session.
+
+    The per-command results are split back out of the ios_command result and
+    stored exactly as the per-command mode would store them. Returns True if
+    the device answered.
+    """
+    commands = [command_text for command_text, _ in commands]
+    if CAPTURE_MODE == "stream":
+        records = []
+        _, log, host_logs = stream_ansible_playbook(
+            get_playbooks()["show_all_commands"],
+            inventory_path,
+            records.append,
+            {"show_commands": commands},
+        )
+        if records:
+            outputs, error = record_outputs(records[0])
+        else:
+            outputs, error = None, unreported_log(log, host_logs, ip)
+        return save_split_outputs(
+            ip,
+            commands,
+            split_command_outputs(outputs, commands),
+            error or log or "No output found for command",
+            results,
+        )
+
+    rc, stdout, stderr = run_ansible_playbook(
+        get_playbooks()["show_all_commands"],
+        inventory_path,
+        {"show_commands": commands},
+    )
+    if rc != 0:
+        err_text = stderr or stdout or "ansible-playbook returned non-zero exit code"
+        return save_split_outputs(ip, commands, {}, err_text, results)
+
+    outputs = parse_ansible_command_outputs(stdout, commands)
+    return save_split_outputs(
+        ip,
+        commands,
+        outputs,
+        (stdout or "").strip() or "No output found for command",
+        results,
+    )
+
+
+def write_batch_inventory(jobs):
+    """Write one inventory holding every device of a batch under group [routers].
+
+    The inventory is YAML (written as JSON) so each host can carry its own
+    'show_commands' list.
+    """
+    # Batches can run concurrently, so each executor thread gets its own file
+    inventory_path = f"/tmp/inventory_batch_{os.getpid()}_{threading.get_ident()}.json"
+    hosts = {}
+    for ip, username, password, commands in jobs:
+        hosts[ip] = {
+            "ansible_host": ip,
+            "ansible_user": username,
+            "ansible_password": password,
+            "ansible_network_os": "cisco.ios.ios",
+            "ansible_connection": "network_cli",
+            "show_commands": [command_text for command_text, _ in commands],
+        }
+    with open(inventory_path, "w") as f:
+        json.dump({"routers": {"hosts": hosts}}, f)
+    return inventory_path
+
 
-            rc, stdout, stderr = run_ansible_playbook(playbook_file, inventory_path)
-            if rc == 0:
-                parsed = parse_ansible_output(stdout)
-                # If parsing produced nothing, prefer the raw stdout or stderr
-                if not parsed or parsed.strip() == "":
-                    parsed = (stdout or "").strip() or (stderr or "").strip() or ""
+def merge_batch_jobs(jobs):
+    """Fold jobs for the same device into one, in order of first arrival.
 
-                normalized = normalize_output(command_text, parsed)
-                save_command_output(ip, command_text, normalized, success=True)
+    A device queued twice in the same window only needs polling once, for
+    the union of the commands asked for; None (every command) wins. The
+    newest job's credentials are used.
+    """
+    merged = {}
+    for ip, username, password, commands in jobs:
+        if ip in merged:
+            previous = merged[ip][3]
+            if previous is None or not commands:
+                commands = None
             else:
-                err_text = (
-                    stderr or stdout or "ansible-playbook returned non-zero exit code"
-                )
-                save_command_output(ip, command_text, "", success=False, error=err_text)
+                commands = previous + [c for c in commands if c not in previous]
+        else:
+            commands = list(commands) if commands else None
+        merged[ip] = (ip, username, password, commands)
+    return list(merged.values())
+
+
+def process_batch(jobs):
+    """Poll several devices with a single multi-host playbook run.
+
+    'jobs' is a list of (ip, username, password, commands). Inventory hosts
+    are named after the device IP, so the per-host results of the JSON
+    callback map straight back to each device. Ansible exits non-zero as soon
+    as one host fails, so success is decided per host rather than from the
+    return code.
+    """
+    jobs = [
+        (ip, username, password, select_commands(commands))
+        for ip, username, password, commands in merge_batch_jobs(jobs)
+    ]
+    if CAPTURE_MODE == "stream":
+        return stream_batch(jobs)
+    try:
+        inventory_path = write_batch_inventory(jobs)
+        rc, stdout, stderr = run_ansible_playbook(
+            get_playbooks()["show_all_commands"],
+            inventory_path,
+            forks=ANSIBLE_FORKS,
+            # Hosts beyond the fork count run in later waves of the same play
+            timeout=120 * math.ceil(len(jobs) / ANSIBLE_FORKS),
+        )
+        outputs, errors = parse_ansible_host_results(stdout)
     except Exception as e:
-        save_command_output(
-            ip, "show ip interface brief", "", success=False, error=str(e)
+        rc, stdout, stderr = 1, "", str(e)
+        outputs, errors = {}, {}
+
+    # Every device's records go to Mongo in one bulk insert
+    results = []
+    for ip, _, _, commands in jobs:
+        commands = [command_text for command_text, _ in commands]
+        err_text = (
+            errors.get(ip)
+            or stderr
+            or stdout
+            or "ansible-playbook returned non-zero exit code"
+        )
+        reachable = save_split_outputs(
+            ip,
+            commands,
+            split_command_outputs(outputs.get(ip), commands),
+            err_text,
+            results,
         )
+        db.record_poll_result(ip, reachable)
+    db.set_device_infos(results)
+    print(f"Batch of {len(jobs)} devices finished (rc={rc}, ok={len(outputs)})")
 
 
-def callback(ch, method, properties, body):
+def persist_host(pending, ip, outputs, error):
+    """Store a batch device's results and take it off 'pending'."""
+    commands = pending.pop(ip)
+    results = []
+    reachable = save_split_outputs(
+        ip, commands, split_command_outputs(outputs, commands), error, results
+    )
+    db.set_device_infos(results)
+    db.record_poll_result(ip, reachable)
+
+
+def persist_record(pending, record):
+    """Persist the device an ndjson record reports on, if still pending."""
+    if record.get("host") in pending:
+        outputs, error = record_outputs(record)
+        persist_host(pending, record["host"], outputs, error)
+
+
+def stream_batch(jobs):
+    """process_batch with the ndjson callback: each device's results are
+    persisted as soon as its record arrives instead of after the whole run.
+    """
+    # ip -> command texts, for devices whose results are not stored yet
+    pending = {
+        ip: [command_text for command_text, _ in cmds] for ip, _, _, cmds in jobs
+    }
     try:
-        data = json.loads(body)
-        print("Decoded JSON:", data)
-        ip = data.get("ip_address") or data.get("ip")
-        username = data.get("username")
-        password = data.get("password")
-        device_type = "cisco_ios"
+        inventory_path = write_batch_inventory(jobs)
+    except OSError as e:
+        rc, log, host_logs = 1, str(e), {}
+    else:
+        rc, log, host_logs = stream_ansible_playbook(
+            get_playbooks()["show_all_commands"],
+            inventory_path,
+            functools.partial(persist_record, pending),
+            forks=ANSIBLE_FORKS,
+            timeout=120 * math.ceil(len(jobs) / ANSIBLE_FORKS),
+        )
+    # Devices ansible never reported on get the run's log as their error
+    streamed = len(jobs) - len(pending)
+    for ip in list(pending):
+        persist_host(
+            pending,
+            ip,
+            None,
+            unreported_log(log, host_logs, ip)
+            or "ansible-playbook returned non-zero exit code",
+        )
+    print(f"Batch of {len(jobs)} devices finished (rc={rc}, streamed={streamed})")
+
+
+def get_session_pool():
+    global _session_pool
+    if _session_pool is None:
+        _session_pool = SessionPool(
+            max_sessions=SESSION_POOL_SIZE,
+            idle_timeout=SESSION_IDLE_TIMEOUT,
+            keepalive=SESSION_KEEPALIVE,
+        )
+    return _session_pool
+
+
+def collect_netmiko(ip, username, password, device_type, commands, results):
+    """Run the commands over a pooled netmiko session to the device.
+
+    Returns True if the device answered.
+    """
+    commands = [command_text for command_text, _ in commands]
+    try:
+        with get_session_pool().session(ip, username, password, device_type) as conn:
+            outputs = {
+                command_text: conn.send_command(command_text)
+                for command_text in commands
+            }
+    except Exception as e:
+        return save_split_outputs(ip, commands, {}, str(e), results)
+    return save_split_outputs(ip, commands, outputs, None, results)
+
+
+def _cpu_seconds():
+    """CPU time of this process and its finished children (ansible-playbook)."""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def process_job(ip, username, password, device_type="cisco_ios", commands=None):
+    """
+    Minimal job runner for a single network device.
+    - Runs the requested commands (every entry of COMMANDS by default)
+    - With COLLECTOR_ENGINE=netmiko, runs the commands over a pooled SSH session
+    - Otherwise creates a temporary inventory with the provided credentials
+      under group [routers] and runs the show commands, either in one combined
+      playbook or one per command depending on ANSIBLE_COLLECT_MODE
+    - Parses output and stores all of the job's results in MongoDB at once
+    - Records whether the device answered, which drives the scheduler's backoff
+    """
+    started = time.monotonic()
+    cpu_started = _cpu_seconds()
+    commands = select_commands(commands)
+    reachable = False
+    # Buffered here and written with one bulk insert once the job is done
+    results = []
+    try:
+        if COLLECTOR_ENGINE == "netmiko":
+            reachable = collect_netmiko(
+                ip, username, password, device_type, commands, results
+            )
+        else:
+            inventory_path = write_inventory(ip, username, password)
+            if COLLECT_MODE == "per_command":
+                reachable = collect_per_command(ip, inventory_path, commands, results)
+            else:
+                reachable = collect_combined(ip, inventory_path, commands, results)
+    except Exception as e:
+        save_command_output(
+            ip,
+            "show ip interface brief",
+            "",
+            success=False,
+            error=str(e),
+            results=results,
+        )
+    db.set_device_infos(results)
+    db.record_poll_result(ip, reachable)
+    # Logged per job so the two engines can be compared on latency and CPU
+    print(
+        f"[{COLLECTOR_ENGINE}] {ip} polled in {time.monotonic() - started:.2f}s "
+        f"(cpu {_cpu_seconds() - cpu_started:.2f}s)"
+    )
+
+
+def interface_statuses(interfaces):
+    """Rows of the device page's interface table from parsed interfaces."""
+    if not isinstance(interfaces, list):
+        return None
+    return [
+        {
+            "name": iface.get("interface", ""),
+            "status": iface.get("status", ""),
+            "ip": iface.get("ip_address", ""),
+            "enabled": iface.get("status", "").lower() == "up",
+        }
+        for iface in interfaces
+    ]
 
-        if not ip or not username or not password:
-            raise ValueError("ip/username/password missing in message")
 
-        process_job(ip, username, password, device_type)
+def run_config_job(job_id):
+    """Push a config job's commands and record the interfaces' new state.
 
+    The 'show ip interface brief' taken after the push is stored like a
+    poll result, so the device page shows it without waiting for the next
+    polling cycle.
+    """
+    job = db.claim_config_job(job_id)
+    if job is None:
+        print(f"Config job {job_id} is not queued, skipping")
+        return
+    ip = job["ip"]
+    device = db.get_device(ip)
+    if device is None:
+        db.finish_config_job(job_id, False, "Device not found")
+        return
+
+    command_text = "show ip interface brief"
+    try:
+        with get_session_pool().session(
+            ip, device.get("username"), device.get("password"), "cisco_ios"
+        ) as conn:
+            conn.send_config_set(job["commands"])
+            output = conn.send_command(command_text)
     except Exception as e:
-        print("Failed to process message:", e)
+        print(f"Config job {job_id} on {ip} failed: {e}")
+        db.finish_config_job(job_id, False, str(e))
+        return
+
+    results = []
+    save_split_outputs(ip, [command_text], {command_text: output}, None, results)
+    interfaces = interface_statuses(results[0]["output"])
+    db.set_device_infos(results)
+    db.finish_config_job(job_id, True, "Changes applied and saved.", interfaces)
+    print(f"Config job {job_id} applied {len(job['commands'])} lines on {ip}")
+
+
+def decode_job(body):
+    """Return (ip, username, password, commands) from a job message body.
+
+    'commands' is None when the message does not restrict the commands.
+    """
+    data = json.loads(body)
+    print("Decoded JSON:", data)
+    ip = data.get("ip_address") or data.get("ip")
+    username = data.get("username")
+    password = data.get("password")
+
+    if not ip or not username or not password:
+        raise ValueError("ip/username/password missing in message")
+    return ip, username, password, data.get("commands")
+
+
+class JobConsumer:
+    """Consume job messages into a pool of executor threads.
+
+    The pika connection is only touched from the thread running
+    start_consuming, which therefore keeps servicing heartbeats while jobs
+    run. Messages are acked once their results have been persisted; executor
+    threads hand the ack back through add_callback_threadsafe.
+    """
+
+    def __init__(self, connection, channel, concurrency, batch_size):
+        self.connection = connection
+        self.channel = channel
+        self.batch_size = batch_size
+        self.executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="job"
+        )
+        # (method, job) waiting to be polled together in batch mode
+        self.pending = []
+        self.flush_timer = None
+
+    def callback(self, ch, method, properties, body):
+        try:
+            ip, username, password, commands = decode_job(body)
+        except Exception as e:
+            print("Failed to process message:", e)
+            ch.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
+            return
+
+        if self.batch_size <= 1:
+            self.submit(
+                [method], process_job, ip, username, password, "cisco_ios", commands
+            )
+            return
+
+        self.pending.append((method, (ip, username, password, commands)))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.flush_timer is None:
+            self.flush_timer = self.connection.call_later(
+                BATCH_WINDOW, self.on_flush_timer
+            )
+
+    def on_flush_timer(self):
+        self.flush_timer = None
+        self.flush()
+
+    def flush(self):
+        """Submit the pending jobs as one batch."""
+        if self.flush_timer is not None:
+            self.connection.remove_timeout(self.flush_timer)
+            self.flush_timer = None
+        if not self.pending:
+            return
+        methods = [method for method, _ in self.pending]
+        jobs = [job for _, job in self.pending]
+        self.pending = []
+        self.submit(methods, process_batch, jobs)
+
+    def submit(self, methods, fn, *args):
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(
+            lambda f: self.connection.add_callback_threadsafe(
+                functools.partial(self.settle, methods, f)
+            )
+        )
+
+    def settle(self, methods, future):
+        """Ack finished messages; runs on the connection thread."""
+        error = future.exception()
+        for method in methods:
+            if error is None:
+                self.channel.basic_ack(delivery_tag=method.delivery_tag)
+            else:
+                # Results could not be persisted; retry once on another delivery
+                print("Job failed, results not persisted:", error)
+                self.channel.basic_nack(
+                    delivery_tag=method.delivery_tag, requeue=not method.redelivered
+                )
+
+    def shutdown(self):
+        self.flush()
+        self.executor.shutdown(wait=True)
+        # Deliver the acks queued by the last jobs
+        self.connection.process_data_events(time_limit=0)
+
+
+class ConfigJobConsumer(JobConsumer):
+    """Consume config-push messages, which carry the job's id and device IP.
+
+    Pushes to a device run one at a time and at least 'interval' seconds
+    apart. Messages for a device that is busy wait in its queue on the
+    connection thread, and the pause between pushes is a connection timer,
+    so they never hold an executor thread that other devices could use.
+    """
+
+    def __init__(self, connection, channel, concurrency, interval):
+        super().__init__(connection, channel, concurrency, batch_size=1)
+        self.interval = interval
+        # ip -> deque of (method, job_id); the head is running or due next
+        self.device_jobs = {}
+        # ip -> monotonic time its last push finished
+        self.last_push = {}
+        # delivery tag -> ip of the running push
+        self.running = {}
+
+    def callback(self, ch, method, properties, body):
+        try:
+            data = json.loads(body)
+            job_id = data["job_id"]
+        except Exception as e:
+            print("Failed to process config job message:", e)
+            ch.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
+            return
+        # Messages queued by an older web app lack the IP; run those in turn
+        ip = data.get("ip", "")
+        jobs = self.device_jobs.setdefault(ip, collections.deque())
+        jobs.append((method, job_id))
+        if len(jobs) == 1:
+            self.schedule(ip)
+
+    def schedule(self, ip):
+        """Start the device's next push, or set a timer for when it is due."""
+        last = self.last_push.get(ip)
+        wait = 0 if last is None else last + self.interval - time.monotonic()
+        if wait > 0:
+            self.connection.call_later(wait, functools.partial(self.start, ip))
+        else:
+            self.start(ip)
+
+    def start(self, ip):
+        jobs = self.device_jobs.get(ip)
+        if not jobs:
+            # Timer fired after shutdown gave the message back
+            return
+        method, job_id = jobs[0]
+        self.running[method.delivery_tag] = ip
+        self.submit([method], run_config_job, job_id)
+
+    def settle(self, methods, future):
+        super().settle(methods, future)
+        for method in methods:
+            ip = self.running.pop(method.delivery_tag)
+            self.last_push[ip] = time.monotonic()
+            jobs = self.device_jobs[ip]
+            jobs.popleft()
+            if jobs:
+                self.schedule(ip)
+            else:
+                del self.device_jobs[ip]
+
+    def shutdown(self):
+        # Pushes not started yet go back to the queue for the next worker
+        for ip, jobs in list(self.device_jobs.items()):
+            for method, _ in jobs:
+                if method.delivery_tag not in self.running:
+                    self.channel.basic_nack(delivery_tag=method.delivery_tag)
+            started = [job for job in jobs if job[0].delivery_tag in self.running]
+            if started:
+                self.device_jobs[ip] = collections.deque(started)
+            else:
+                del self.device_jobs[ip]
+        super().shutdown()
 
 
 def main():
+    try:
+        db.ensure_indexes()
+    except Exception as e:
+        print("Could not ensure MongoDB indexes:", e)
+
     # Support both styles of env vars and prefer the ones used in docker-compose
     rabbit_user = os.getenv("RABBITMQ_DEFAULT_USER") or os.getenv("RABBITMQ_USER")
     rabbit_pass = os.getenv("RABBITMQ_DEFAULT_PASS") or os.getenv("RABBITMQ_PASSWORD")
@@ -477,11 +1033,42 @@ def main():
     channel = connection.channel()
     queue_name = os.getenv("RABBITMQ_QUEUE", "router_jobs")
     channel.queue_declare(queue=queue_name)
-    channel.basic_qos(prefetch_count=1)
-    channel.basic_consume(queue=queue_name, on_message_callback=callback, auto_ack=True)
 
-    print(f"Waiting for messages on queue '{queue_name}'...")
-    channel.start_consuming()
+    # Batching only applies to the ansible engine; netmiko reuses sessions
+    batch_size = BATCH_SIZE if COLLECTOR_ENGINE == "ansible" else 1
+    prefetch = effective_prefetch(batch_size)
+    channel.basic_qos(prefetch_count=prefetch)
+    consumer = JobConsumer(connection, channel, CONCURRENCY, batch_size)
+    channel.basic_consume(queue=queue_name, on_message_callback=consumer.callback)
+
+    # Declared here too, so pushes queued before the web app's first publish
+    # are not lost
+    channel.exchange_declare(exchange=CONFIG_EXCHANGE, exchange_type="direct")
+    channel.queue_declare(queue=CONFIG_QUEUE)
+    channel.queue_bind(
+        queue=CONFIG_QUEUE, exchange=CONFIG_EXCHANGE, routing_key=CONFIG_ROUTING_KEY
+    )
+    # Applies to the consumer started below only
+    channel.basic_qos(prefetch_count=max(CONFIG_PREFETCH, CONFIG_PUSH_CONCURRENCY))
+    config_consumer = ConfigJobConsumer(
+        connection, channel, CONFIG_PUSH_CONCURRENCY, CONFIG_PUSH_INTERVAL
+    )
+    channel.basic_consume(
+        queue=CONFIG_QUEUE, on_message_callback=config_consumer.callback
+    )
+
+    print(
+        f"Waiting for messages on queue '{queue_name}' "
+        f"({CONCURRENCY} executors, prefetch {prefetch}, batch size {batch_size}) "
+        f"and '{CONFIG_QUEUE}' ({CONFIG_PUSH_CONCURRENCY} executors)..."
+    )
+    try:
+        channel.start_consuming()
+    except KeyboardInterrupt:
+        channel.stop_consuming()
+        consumer.shutdown()
+        config_consumer.shutdown()
+        connection.close()
 
 
 if __name__ == "__main__":